@@ -13,32 +13,83 @@ but a more accurate vector interpolation is under development.
 
 The interpolation is obtained by triangulation of the starting grid and seaprate interpolation to the new grid.
 The weights are preserved and they can be used for repeated application of the same set of grids.
+The barycentric weights of the linear interpolation are computed once and stored as a sparse matrix,
+therefore each interpolation is a sparse matrix-vector product.
+
+First order conservative remapping is also available. The weights are the overlap areas of the
+source cells, with corners at the f-points, with the cells of the regular target grid, normalized 
+by the area of each target cell covered by sea cells. They are computed by clipping the cells 
+in the (longitude, sine of latitude) plane, where the cells of regular grids are exact.
+
+The vertical interpolation to standard depths or pressure levels computes the bracketing 
+levels and weights once and applies them to whole arrays, lazily for `dask` arrays.
 
 Classes 
 -------
 | **Atmosphere_Interpolator**
 | **Ocean_Interpolator**
+| **Ocean_Interpolator3D**
+| **Vertical_Interpolator**
+| **Interp_Store**
+| **Grid_Registry**
 
 
 
 '''
 
 import os
-import math
 import numpy as np
+import time
 import pickle
 import gzip
+import json
+import hashlib
 
 import scipy.linalg as sc
 import scipy.special as sp
-import scipy.interpolate as spint
 import scipy.spatial.qhull as qhull
-from scipy.spatial import Delaunay
+import scipy.sparse as sparse
+from concurrent.futures import ThreadPoolExecutor
+from scipy.spatial import Delaunay, cKDTree
 
 
 import zapata.lib as zlib
 
 import xarray as xr
+import dask
+
+# Directory of the auxiliary Ocean files
+MASK_DIR = os.path.expanduser("~") + '/Dropbox (CMCC)/data_zapata'
+
+# Interpolation methods and the names of their weights for scalars and vectors
+WEIGHTS = {'linear': ('weights', 'weights_UV'), 
+           'nearest': ('weights_nearest', 'weights_UV_nearest'),
+           'idw': ('weights_idw', 'weights_UV_idw'),
+           'conservative': ('weights_conservative', 'weights_UV_conservative')}
+
+# Number of neighbours and power of the inverse distance weighting
+IDW_NEIGHBOURS = 4
+IDW_POWER = 2.
+
+# Ocean grids of the default registry, the files are relative to `MASK_DIR`
+GRIDS = {
+    'L75_025_TRP_GLO': {'kind': 'tripolar', 'description': 'Tripolar L75 0.25 Grid', 'level_dim': 'z',
+                        'mask': 'L75_025_TRP_GLO/tmask_UVT_latlon_coordinates.nc',
+                        'coords': 'L75_025_TRP_GLO/NEMO_coordinates.nc',
+                        'angle': 'L75_025_TRP_GLO/ORCA025L75_angle.nc'},
+    'L44_025_TRP_GLO': {'kind': 'tripolar', 'description': 'Tripolar L44 0.25 Grid', 'level_dim': 'z',
+                        'mask': 'L44_025_TRP_GLO/tmask44_UVT_latlon_coordinates.nc',
+                        'coords': 'L75_025_TRP_GLO/NEMO_coordinates.nc',
+                        'angle': 'L75_025_TRP_GLO/ORCA025L75_angle.nc'},
+    'L75_025_REG_GLO': {'kind': 'regular', 'description': 'Regular L75 0.25 Lat-Lon Grid', 'level_dim': 'z',
+                        'mask': 'L75_025_REG_GLO/GLO-MFC_001_025_mask_bathy.nc', 'mask_var': 'mask',
+                        'rename': {'longitude': 'T_lon', 'latitude': 'T_lat'}},
+    'L44_025_REG_GLO': {'kind': 'regular', 'description': 'Regular L44 0.25 Lat-Lon Grid from WOA', 'level_dim': 'depth',
+                        'mask': 'WOA/m025x025L44.nc', 'mask_var': 'm025x025L44', 'cent_long': 720}}
+
+# Variables of the tripolar grids in the coordinates file
+NEMO_COORDS = {'lonT': 'glamt', 'latT': 'gphit', 'lonU': 'glamu', 'latU': 'gphiu',
+               'lonV': 'glamv', 'latV': 'gphiv', 'lonF': 'glamf', 'latF': 'gphif'}
 
 
 class Atmosphere_Interpolator():
@@ -54,14 +105,16 @@ class Atmosphere_Interpolator():
     Parameters
     ----------
 
-    grid : str
+    grid : str or xarray
         Choice of output grids  
 
         * `1x1`  -- Regular 1 degree 
         * `025x025`  -- Coupled model grid, nominally 0.25, 
 
+        or a `DataArray` with coordinates `lat` and `lon`
+
     option : str
-        'linear', interpolation method
+        'linear' or 'nearest', interpolation method
 
     Attributes
     ----------
@@ -70,14 +123,20 @@ class Atmosphere_Interpolator():
         Name of the interpolator
     grid : str
         Option for the grid
-    option : str
+    choice : str
         Interpolation method
+    tgt : xarray
+        Target grid, read at first use
 
     
     Notes
     =====
 
-    It is a thin wrapper around `xarray` `interp_like` method.
+    The interpolation between regular grids is separable, the weights are two 1D sparse
+    matrices for latitude and longitude, periodic in longitude for global grids. 
+    They are computed at the first interpolation from a source grid and reused for 
+    the following ones, the fields are interpolated at once for all the leading dimensions. 
+    The target grids are read only when needed and they are cached.
     
     Examples    
     --------    
@@ -87,12 +146,12 @@ class Atmosphere_Interpolator():
     
     Interpolate temperature
 
-    >>> target_xarray=w.interp_f(src_xarray)
+    >>> target_xarray=w.interp_scalar(src_xarray)
 
     
     """
 
-    __slots__ = ('name','tgt','choice')
+    __slots__ = ('name','grid','choice','_weights')
 
     
 
@@ -102,25 +161,13 @@ class Atmosphere_Interpolator():
         # Put here info on grids to be obtained from __call__
         self.name = 'Atmosphere_Interpolator'
         '''str: Name of the Interpolator'''
-        if grid == '1x1':
-            # Selected regular 1 Degree grid
-            lon1x1 = np.linspace(0,359,360)
-            lat1x1 = np.linspace(-90,90,180)
-            mm=np.ones([lat1x1.shape[0],lon1x1.shape[0]])
-            tgt = xr.DataArray(mm,dims=['lat','lon'],\
-                            coords={'lat':lat1x1,'lon':lon1x1})  
-        elif grid == '025x025':
-            homedir = os.path.expanduser("~")
-            file = homedir + '/Dropbox (CMCC)/data_zapata/'+ 'masks_CMCC-CM2_VHR4_AGCM.nc'
-            dst=xr.open_dataset(file,decode_times=False)
-            lat25 = dst.yc.data[:,0]
-            lon25 = dst.xc.data[0,:]
-            tgt = xr.DataArray(dst.mask,dims=['lat','lon'],\
-                            coords={'lat':lat25,'lon':lon25})  
-        else:
-            SystemError(f'Wrong Option in {self.name} --> {grid}')  
-        self.tgt = tgt
-        '''xarray: Target grid'''    
+        if not isinstance(grid, xr.DataArray) and grid not in ATM_GRIDS:
+            raise SystemError(f'Wrong Option in {self.name} --> {grid}')  
+        if option not in ('linear', 'nearest'):
+            raise SystemError(f'Wrong Option in {self.name} --> {option}')  
+        self.grid = grid
+        '''str: Target grid'''
+        self._weights = {}
         return
         
     def __call__(self):
@@ -129,6 +176,33 @@ class Atmosphere_Interpolator():
     def __repr__(self):
         '''  Printing other info '''
         return '\n' 
+
+    @property
+    def tgt(self):
+        '''xarray: Target grid'''
+        if isinstance(self.grid, xr.DataArray):
+            return self.grid
+        return atm_grid(self.grid)
+
+    def weights(self, lat, lon):
+        '''
+        Interpolation weights from the source grid with coordinates `lat`, `lon`.
+
+        The weights are cached for each source grid.
+
+        Returns
+        -------
+        wlat, wlon :
+            Sparse matrices of the weights in latitude and longitude
+        '''
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        key = hashlib.sha1(lat.tobytes() + b'/' + lon.tobytes()).hexdigest()
+        if key not in self._weights:
+            tgt = self.tgt
+            self._weights[key] = (weights_1d(lat, tgt.lat.values, self.choice), \
+                                  weights_1d(lon, tgt.lon.values, self.choice, period=360.))
+        return self._weights[key]
     
     def interp_scalar(self, xdata):
         ''' 
@@ -138,7 +212,9 @@ class Atmosphere_Interpolator():
         Parameters
         ----------
         xdata :  xarray
-            2D array to be interpolated, it must be on the `src_grid`
+            Array to be interpolated with dimensions (..., lat, lon), 
+            it must be on the `src_grid`. The leading dimensions, e.g. `time`
+            and `lev`, are interpolated at once.
         
         Returns
         -------
@@ -146,9 +222,100 @@ class Atmosphere_Interpolator():
             Interpolated xarray on the target grid
         
         '''
-        
-        res = xdata.interp_like(self.tgt,method=self.choice)
-        return res
+        wlat, wlon = self.weights(xdata.lat.values, xdata.lon.values)
+        tgt = self.tgt
+        if xdata.chunks is not None:
+            xdata = xdata.chunk({'lat': -1, 'lon': -1})
+        res = xr.apply_ufunc(_separable, xdata, kwargs={'wlat': wlat, 'wlon': wlon},
+                             input_core_dims=[['lat', 'lon']], output_core_dims=[['lat', 'lon']],
+                             exclude_dims={'lat', 'lon'}, dask='parallelized', output_dtypes=[float],
+                             dask_gufunc_kwargs={'output_sizes': {'lat': tgt.lat.size, 'lon': tgt.lon.size}})
+        return res.assign_coords({'lat': tgt.lat.values, 'lon': tgt.lon.values})
+
+# Target grids of the Atmosphere_Interpolator, read at first use
+ATM_GRIDS = ('1x1', '025x025')
+_atm_grids = {}
+
+def atm_grid(grid):
+    '''
+    Target grid `grid` for the `Atmosphere_Interpolator`.
+
+    The grids are built, or read from file, once and cached.
+    '''
+    if grid not in _atm_grids:
+        if grid == '1x1':
+            # Selected regular 1 Degree grid
+            lon1x1 = np.linspace(0,359,360)
+            lat1x1 = np.linspace(-90,90,180)
+            mm=np.ones([lat1x1.shape[0],lon1x1.shape[0]])
+            tgt = xr.DataArray(mm,dims=['lat','lon'],\
+                            coords={'lat':lat1x1,'lon':lon1x1})  
+        elif grid == '025x025':
+            file = MASK_DIR + '/' + 'masks_CMCC-CM2_VHR4_AGCM.nc'
+            dst=xr.open_dataset(file,decode_times=False)
+            lat25 = dst.yc.data[:,0]
+            lon25 = dst.xc.data[0,:]
+            tgt = xr.DataArray(dst.mask,dims=['lat','lon'],\
+                            coords={'lat':lat25,'lon':lon25})  
+        else:
+            raise SystemError(f'Wrong Option in atm_grid --> {grid}')  
+        _atm_grids[grid] = tgt
+    return _atm_grids[grid]
+
+def weights_1d(x, xt, method='linear', period=None):
+    '''
+    Sparse matrix of the 1D interpolation weights from `x` to `xt`
+
+    Parameters
+    ----------
+    x : 
+        Source coordinate, monotonic
+    xt :
+        Target coordinate
+    method :
+        'linear' or 'nearest'
+    period :
+        Period of the coordinate, e.g. 360 for longitude. It is used only
+        if `x` covers a whole period.
+
+    Returns
+    -------
+    W :
+        Sparse CSR matrix (len(xt), len(x)), points outside `x` have no weights
+    '''
+    order = np.argsort(x)
+    xs = x[order]
+    xt = np.asarray(xt, dtype=float)
+    if period is not None and len(xs) > 1 and xs[-1] - xs[0] + np.diff(xs).max() >= period - 1.e-6:
+        # periodic coordinate
+        xs = np.r_[xs, xs[0] + period]
+        order = np.r_[order, order[0]]
+        xt = xs[0] + (xt - xs[0]) % period
+    i = np.clip(np.searchsorted(xs, xt, 'right') - 1, 0, len(xs) - 2)
+    t = (xt - xs[i]) / (xs[i + 1] - xs[i])
+    inside = np.flatnonzero((t >= 0) & (t <= 1))
+    i = i[inside]
+    t = t[inside]
+    if method == 'nearest':
+        rows = inside
+        cols = order[np.where(t < 0.5, i, i + 1)]
+        w = np.ones(inside.size)
+    else:
+        rows = np.r_[inside, inside]
+        cols = np.r_[order[i], order[i + 1]]
+        w = np.r_[1 - t, t]
+    keep = w != 0
+    return sparse.csr_matrix((w[keep], (rows[keep], cols[keep])), shape=(len(xt), len(x)))
+
+def _separable(x, wlat, wlon):
+    '''Apply the separable weights to `x` (..., lat, lon)'''
+    lead = x.shape[:-2]
+    nlat, nlon = x.shape[-2:]
+    m = int(np.prod(lead))
+    y = remap(wlon, x.reshape(m * nlat, nlon).T.astype(float))
+    y = y.reshape(-1, m, nlat).transpose(2, 1, 0).reshape(nlat, -1)
+    y = remap(wlat, y)
+    return y.reshape(-1, m, wlon.shape[0]).transpose(1, 0, 2).reshape(lead + (wlat.shape[0], wlon.shape[0]))
 
 class Ocean_Interpolator():
     """This class creates weights for interpolation of ocean fields.
@@ -191,6 +358,12 @@ class Ocean_Interpolator():
         Minimum number of points in the sea-over-land process
     verbose: bool
         Lots of output
+    s_in, s_out : dict
+        Source and target grids already resolved by `_resolve_grid`,
+        the mask files are not read again
+    methods : tuple
+        Methods of `WEIGHTS` built at construction, the linear weights are always built.
+        The other methods are built the first time they are used
 
     Attributes
     ----------
@@ -225,8 +398,28 @@ class Ocean_Interpolator():
         Longitudes of input V-mask
     V_lat : 
         Latitudes of input V-mask
+    F_lon, F_lat :
+        Coordinates of the F points of the input grid, corners of the T cells for 
+        the conservative remapping, None if the grid has no F points
     tangle :
         Angles of the T points of the input grid
+    stencil_U, stencil_V :
+        Border points and sparse sea-over-land stencils of the U and V grids
+    timings :
+        Time in seconds spent in each stage of the construction
+    weights :
+        Sparse matrix of the linear interpolation weights from the sea T points
+        to the sea points of the target grid
+    weights_UV :
+        Sparse operator for the linear interpolation of (U,V) to the target grid
+    weights_nearest, weights_UV_nearest :
+        Sparse weights and operator for the nearest point interpolation
+    weights_idw, weights_UV_idw :
+        Sparse weights and operator for the inverse distance weighting interpolation
+    weights_conservative, weights_UV_conservative :
+        Sparse weights and operator for the first order conservative remapping
+        
+        The weights of a method are None until the method is built
     mask_reg :
         Mask of the Target grid
     cent_long :
@@ -254,6 +447,9 @@ class Ocean_Interpolator():
     
     to_file :
         Writes interpolator object to file (pickled format)
+
+    to_compact :
+        Writes the interpolation weights to a compact, memory-mappable directory
     
     Examples    
     --------    
@@ -274,13 +470,16 @@ class Ocean_Interpolator():
 
     __slots__ = ('mask','masku','maskv','mdir', 'mask_reg', \
                 'sea_index','sea_index_U','sea_index_V', \
-                'latlon', 'masT_vec', 'maskub','maskvb','masktb',\
-                'latlon_reg','sea_index_reg','regmask_vec', \
-                'T_lat','T_lon','U_lat','U_lon','V_lat','V_lon',\
-                'name','cent_long','tri_sea_T','tri_sea_U','tri_sea_V','tangle',\
-                    'ingrid','outgrid','level','window','period')
-
-    def __init__(self, src_grid_name, tgt_grid_name,level=1,verbose=False,window=3,period=1):
+                'latlon', 'maskub','maskvb','masktb',\
+                'latlon_reg','sea_index_reg','timings', \
+                'T_lat','T_lon','U_lat','U_lon','V_lat','V_lon','F_lat','F_lon',\
+                'name','cent_long','tri_sea_T','tri_sea_U','tri_sea_V','tangle','stencil_U','stencil_V',\
+                    'ingrid','outgrid','level','window','period','weights','weights_UV',\
+                    'weights_nearest','weights_UV_nearest','weights_idw','weights_UV_idw',\
+                    'weights_conservative','weights_UV_conservative')
+
+    def __init__(self, src_grid_name, tgt_grid_name,level=1,verbose=False,window=3,period=1,s_in=None,s_out=None, \
+                 methods=('linear',)):
         # Put here info on grids to be obtained from __call__
         # This currently works with mask files
         # 'masks_CMCC-CM2_VHR4_AGCM.nc'
@@ -288,8 +487,7 @@ class Ocean_Interpolator():
         # 'ORCA025L50_mesh_mask.nc'
         
         # Path to auxiliary Ocean files
-        homedir = os.path.expanduser("~")
-        self.mdir = homedir + '/Dropbox (CMCC)/data_zapata'
+        self.mdir = grid_registry.mdir
         self.ingrid = src_grid_name
         self.outgrid = tgt_grid_name
         
@@ -303,8 +501,12 @@ class Ocean_Interpolator():
         else:
             SystemError(f' Surface variable not available, Level {level}')
 
+        self.timings = {}
+        clock = time.perf_counter()
+
         #Resolve grids
-        s_in = self._resolve_grid(src_grid_name,level)
+        if s_in is None:
+            s_in = self._resolve_grid(src_grid_name,level)
 
         tk = s_in['tmask']
         self.T_lon = s_in['lonT']
@@ -339,30 +541,94 @@ class Ocean_Interpolator():
     
         self.maskub,self.masku = self.mask_sea_over_land(masku)
         self.maskvb,self.maskv = self.mask_sea_over_land(maskv)
+        self.stencil_U = self._stencil(self.masku, self.maskub)
+        self.stencil_V = self._stencil(self.maskv, self.maskvb)
+        clock = self._timing('source grid and sea over land', clock)
  
         print(f' Generating interpolator for {self.name}')
         if verbose:
             print(self.mask,self.masku,self.maskv)
         
-        # Get triangulation for all grids
-        self.latlon,self.sea_index, self.masT_vec = get_sea(self.mask)
-        self.tri_sea_T  = Delaunay(self.latlon)  # Compute the triangulation for T
-        print(f' computing the triangulation for T grid')
-
-        latlon_U,self.sea_index_U, masU_vec = get_sea(self.masku)
-        self.tri_sea_U  = Delaunay(latlon_U)  # Compute the triangulation for U
-        print(f' computing the triangulation for U grid')
-
-        latlon_V,self.sea_index_V, masT_vec = get_sea(self.maskv)
-        self.tri_sea_V  = Delaunay(latlon_V)  # Compute the triangulation for V
-        print(f' computing the triangulation for V grid')
-        
+        # Sea points of all grids
+        self.latlon,self.sea_index = sea_points(self.mask)
+        latlon_U,self.sea_index_U = sea_points(self.masku)
+        latlon_V,self.sea_index_V = sea_points(self.maskv)
+
         #Target Grid
 
-        s_out = self._resolve_grid(tgt_grid_name,level,verbose=verbose)
+        if s_out is None:
+            s_out = self._resolve_grid(tgt_grid_name,level,verbose=verbose)
         self.mask_reg = s_out['tmask']
         self.cent_long = s_out['cent_long']
-        self.latlon_reg,self.sea_index_reg,self.regmask_vec = get_sea(self.mask_reg)
+        self.latlon_reg,self.sea_index_reg = sea_points(self.mask_reg)
+        clock = self._timing('target grid and sea points', clock)
+
+        # Get triangulation for all grids, Qhull releases the GIL 
+        print(f' computing the triangulations for T, U, V grids')
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            self.tri_sea_T, self.tri_sea_U, self.tri_sea_V = pool.map(Delaunay, [self.latlon, latlon_U, latlon_V])
+        clock = self._timing('triangulations', clock)
+
+        # Interpolation weights T grid --> target grid
+        for k in sum(WEIGHTS.values(), ()):
+            setattr(self, k, None)
+        # Corners of the T cells for the conservative remapping
+        self.F_lon = s_in.get('lonF')
+        self.F_lat = s_in.get('latF')
+        for method in dict.fromkeys(('linear',) + tuple(methods)):
+            self._weights(method, uv=True)
+        print(f' Interpolator built in {sum(self.timings.values()):.1f} s')
+
+    def _weights(self, method='linear', uv=False):
+        '''
+        Weights of `method` for T fields, or the operator for (U,V) if `uv`
+
+        The weights are computed the first time they are requested.
+        '''
+        if method not in WEIGHTS:
+            raise SystemError(f' Error in interpolator , wrong method  {method}')
+        name = WEIGHTS[method][int(uv)]
+        if getattr(self, name) is None:
+            if self.tri_sea_T is None:
+                raise ValueError(f' Method {method} not stored in the interpolator, build it with methods={(method,)}')
+            if uv:
+                self._weights(method)
+                print(f' computing the vector interpolation operator for {method}')
+                clock = time.perf_counter()
+                W = self._uv_operator(method)
+            else:
+                print(f' computing the {method} interpolation weights for the target grid')
+                clock = time.perf_counter()
+                if method == 'linear':
+                    W = linear_weights(self.tri_sea_T, self.latlon_reg)
+                elif method == 'nearest':
+                    W = nearest_weights(self.latlon, self.latlon_reg)
+                elif method == 'conservative':
+                    if self.F_lat is None:
+                        raise ValueError(f' Conservative remapping needs the F points of {self.ingrid}')
+                    lat_edges, lon_edges = regular_edges(self.mask_reg.lat.values, self.mask_reg.lon.values)
+                    corners = nemo_corners(self.F_lat, self.F_lon)[np.asarray(self.sea_index)]
+                    W = conservative_weights(corners, lat_edges, lon_edges)[np.flatnonzero(np.asarray(self.sea_index_reg))]
+                else:
+                    W = nearest_weights(self.latlon, self.latlon_reg, k=IDW_NEIGHBOURS, power=IDW_POWER)
+            setattr(self, name, W)
+            self._timing(f'{method} ' + ('vector operator' if uv else 'weights'), clock)
+        return getattr(self, name)
+
+    def built_methods(self):
+        '''
+        Methods whose weights have been built
+        '''
+        return [m for m, (wT, wUV) in WEIGHTS.items() if getattr(self, wT) is not None]
+
+    def _timing(self, stage, clock):
+        '''
+        Record in `timings` the time spent in `stage` since `clock`
+        '''
+        now = time.perf_counter()
+        self.timings[stage] = now - clock
+        print(f'   {stage:32s} {now - clock:8.2f} s')
+        return now
         
 
     def __call__(self):
@@ -377,50 +643,129 @@ class Ocean_Interpolator():
         print(f' This is for level at depth {self.level} m')
         return '\n' 
     
-    def interp_T(self, xdata, method='linear'):
+    def interp_T(self, xdata, method='linear', chunks=None):
         '''
         
         Perform interpolation for T Grid point to the target grid.
         This methods can be used for scalar quantities.
 
+        The field can have leading dimensions, e.g. `time` or ensemble members,
+        all the slices are interpolated at once as a sparse matrix-matrix product.
+        `dask` arrays are interpolated lazily chunk by chunk.
+
         Parameters
         ----------
         xdata :  xarray
-            2D array to be interpolated, it must be on the `src_grid`
+            Array to be interpolated, it must be on the `src_grid` with dimensions (..., y, x)
         
         method : str    
             Method for interpolation    
                 * 'linear'  , Use linear interpolation
                 * 'nearest' , use nearest interpolation
+                * 'idw'     , inverse distance weighting of the `IDW_NEIGHBOURS` nearest points
+                * 'conservative' , first order conservative remapping, the source grid
+                  must have F points (`latF`, `lonF`) and the target grid must be regular
+
+        chunks : dict
+            Chunks for the leading dimensions, e.g. {'time': 12}, to interpolate with `dask`
 
         Returns
         -------
         out :  xarray
-            Interpolated xarray on the target grid
+            Interpolated xarray on the target grid (..., lat, lon)
+
+        Examples
+        --------
+
+        >>> out = w.interp_T(sst, method='linear', chunks={'time': 12})
+        '''
+
+        if method not in WEIGHTS:
+            raise SystemError(f' Error in interp_T , wrong method  {method}')
+        self._weights(method)
+
+        if chunks is not None:
+            xdata = xdata.chunk(chunks)
+        if xdata.chunks is not None:
+            xdata = xdata.chunk({'y': -1, 'x': -1})
+
+        nlat, nlon = self.mask_reg.shape
+        out = xr.apply_ufunc(self._interp_T_block, xdata, kwargs={'method': method},
+                             input_core_dims=[['y', 'x']], output_core_dims=[['lat', 'lon']],
+                             dask='parallelized', output_dtypes=[float],
+                             dask_gufunc_kwargs={'output_sizes': {'lat': nlat, 'lon': nlon}})
+        return out.assign_coords(self.mask_reg.coords)
+
+    def _interp_T_block(self, data, method='linear'):
+        '''
+        Interpolate the numpy array `data` (..., y, x) to the target grid (..., lat, lon)
+        '''
+        return _remap_block(data, self._block_args(method))
+
+    def _block_args(self, method='linear'):
+        '''
+        Weights and indices needed by `_remap_block` to interpolate T fields with `method`
         '''
+        return (self._weights(method), np.asarray(self.sea_index), np.asarray(self.sea_index_reg), \
+                self.mask_reg.shape, method == 'linear' and self.outgrid == 'L44_025_REG_GLO')
+
+    def _to_target(self, T_reg, lead, dateline=True):
+        '''
+        Put the values `T_reg` (sea points, ...) on the target grid (..., lat, lon)
+        '''
+        return _to_grid(T_reg, lead, np.asarray(self.sea_index_reg), self.mask_reg.shape, \
+                        dateline and self.outgrid == 'L44_025_REG_GLO')
+
+    def interp_T_dask(self, xdata, method='linear', client=None):
+        '''
+        Interpolate a `dask` array of T fields chunk by chunk.
+
+        The interpolation is mapped over the chunks of the leading dimensions, e.g. `time`,
+        with `dask.array.map_blocks`. The weights are a single object in the graph, 
+        if `client` is given they are sent to all the workers once with `client.scatter`.
 
-        # Compute interpolation T
-        Tstack = xdata.stack(ind=('y','x'))
-        sea_T = Tstack[self.sea_index]
-        temp = xr.full_like(self.regmask_vec,np.nan)
-        if method == 'linear':
-            interpolator = spint.LinearNDInterpolator(self.tri_sea_T, sea_T)
-        elif method == 'nearest':
-            interpolator = spint.NearestNDInterpolator(self.tri_sea_T, sea_T)
+        Parameters
+        ----------
+        xdata :  xarray
+            `dask` backed array (..., y, x) on the `src_grid`, e.g. opened with `chunks={'time': 12}`
+        method : str    
+            Method for interpolation, as in `interp_T`
+        client : dask.distributed.Client
+            client for a `dask` cluster, e.g. from `zeus.start_dask`
+
+        Returns
+        -------
+        out :  xarray
+            Lazy interpolated xarray on the target grid (..., lat, lon)
+
+        Examples
+        --------
+
+        >>> client = zeus.start_dask('R000', 36, '80GB', n_workers=4)
+        >>> sst = xr.open_dataset(file, chunks={'time': 12}).sst
+        >>> out = w.interp_T_dask(sst, client=client).mean('time').compute()
+        '''
+        if method not in WEIGHTS:
+            raise SystemError(f' Error in interp_T_dask , wrong method  {method}')
+        if xdata.chunks is None:
+            raise ValueError(' interp_T_dask needs a dask backed array, use interp_T')
+
+        xdata = xdata.transpose(..., 'y', 'x').chunk({'y': -1, 'x': -1})
+        lead = xdata.dims[:-2]
+        args = self._block_args(method)
+        if client is not None:
+            args = client.scatter(args, broadcast=True)
         else:
-            SystemError(f' Error in interp_T , wrong method  {method}')
-        T_reg = interpolator(self.latlon_reg)
-        temp[self.sea_index_reg] = T_reg.data
-        out = temp.unstack()
-        #Fix dateline problem
-        if self.outgrid == 'L44_025_REG_GLO':
-            delx=0.25
-            ddelx=3*delx
-            out[:,1439] = out[:,1438] + delx*(out[:,1]-out[:,1438])/ddelx
-            out[:,0] = out[:,1438] + 2*delx*(out[:,1]-out[:,1438])/ddelx
-        return out
-
-    def interp_UV(self, udata, vdata, method = 'linear'):
+            args = dask.delayed(args, pure=True)
+
+        nlat, nlon = self.mask_reg.shape
+        data = xdata.data.map_blocks(_remap_block, args, dtype=float,
+                                     chunks=xdata.data.chunks[:-2] + ((nlat,), (nlon,)))
+        coords = {k: v for k, v in xdata.coords.items() if set(v.dims) <= set(lead)}
+        out = xr.DataArray(data, dims=lead + ('lat', 'lon'), coords=coords, name=xdata.name)
+        return out.assign_coords(self.mask_reg.coords)
+
+    def interp_UV(self, udata, vdata, method = 'linear', chunks=None):
         '''
         Perform interpolation for U,V Grid point to the target grid.
         This methods can be used for vector quantities.
@@ -428,70 +773,94 @@ class Ocean_Interpolator():
         The present method interpolates the U,V points to the T points, 
         rotates them and then interpolates to the target grid.
 
+        The sea-over-land filling, the interpolation to the T points, the rotation 
+        and the interpolation to the target grid are composed in one sparse operator 
+        the first time `method` is used, so that the interpolation is a single sparse product.
+        The fields can have leading dimensions, e.g. `time`, as in `interp_T`.
+
         Parameters
         ----------
         udata,vdata :  xarray
-            2D array to be interpolated, it must be on the `src_grid`
+            Arrays to be interpolated, they must be on the `src_grid` with dimensions (..., y, x)
+        method : str    
+            Method for interpolation, as in `interp_T`
+        chunks : dict
+            Chunks for the leading dimensions to interpolate with `dask`
         
         Returns
         -------
         out :  xarray
             Interpolated xarray on the target grid
         '''
-        
+        if method not in WEIGHTS:
+            raise SystemError(f' Error in interp_UV , wrong method  {method}')
+        self._weights(method, uv=True)
+
+        if chunks is not None:
+            udata = udata.chunk(chunks)
+            vdata = vdata.chunk(chunks)
+        if udata.chunks is not None or vdata.chunks is not None:
+            udata = udata.chunk({'y': -1, 'x': -1})
+            vdata = vdata.chunk({'y': -1, 'x': -1})
+
+        nlat, nlon = self.mask_reg.shape
+        Uf, Vf = xr.apply_ufunc(self._interp_UV_block, udata, vdata, kwargs={'method': method},
+                                input_core_dims=[['y', 'x'], ['y', 'x']], 
+                                output_core_dims=[['lat', 'lon'], ['lat', 'lon']],
+                                dask='parallelized', output_dtypes=[float, float],
+                                dask_gufunc_kwargs={'output_sizes': {'lat': nlat, 'lon': nlon}})
+        return Uf.assign_coords(self.mask_reg.coords), Vf.assign_coords(self.mask_reg.coords)
+
+    def _interp_UV_block(self, udata, vdata, method='linear'):
+        '''
+        Interpolate the numpy arrays `udata`,`vdata` (..., y, x) to the target grid
+        with the fused operator of `method`
+        '''
+        n = udata.shape[-2] * udata.shape[-1]
+        uv = np.concatenate([udata.reshape(-1, n), vdata.reshape(-1, n)], axis=1).T
         # Insert NaN
-        udata = xr.where(udata < 200,udata, np.nan)
-        vdata = xr.where(vdata < 200,vdata, np.nan)
-
-        #udata,vdata = self.UV_sea_over_land(udata, vdata, self.masku,self.maskv)
-        udata = self.fill_sea_over_land(udata,self.masku)
-        vdata = self.fill_sea_over_land(vdata,self.maskv)
-
-        # Compute interpolation  for U,V
-        Ustack = udata.stack(ind=('y','x'))
-        Vstack = vdata.stack(ind=('y','x'))
-        sea_U = Ustack[self.sea_index_U]
-        sea_V = Vstack[self.sea_index_V]
-
-        #Interpolate to T_grid
-        if method == 'linear':
-            int_U = spint.LinearNDInterpolator(self.tri_sea_U, sea_U)
-            int_V = spint.LinearNDInterpolator(self.tri_sea_V, sea_V)
-        elif method == 'nearest':
-            int_U = spint.NearestNDInterpolator(self.tri_sea_U, sea_U)
-            int_V = spint.NearestNDInterpolator(self.tri_sea_V, sea_V)
-        else:
-            SystemError(f' Error in interp_UV , wrong method  {method}')
-        
-        U_on_T = int_U(self.latlon)
-        V_on_T = int_V(self.latlon)
-        
-        UT = self.masT_vec.copy()
-        VT = self.masT_vec.copy()
-        UT[self.sea_index] = U_on_T.data
-        VT[self.sea_index] = V_on_T.data
-        
-        UT = UT.unstack()
-        VT = VT.unstack()
-
-        #Rotate Velocities
-        fac = self.tangle*math.pi/180.
-        uu = (UT * np.cos(fac) - VT * np.sin(fac)).drop_vars(['nav_lon','nav_lat'])
-        vv = (VT * np.cos(fac) + UT * np.sin(fac)).drop_vars(['nav_lon','nav_lat'])
-
-        # Interpolate to regular grid
-        Uf = self.interp_T( uu, method=method)
-        Vf = self.interp_T( vv, method=method)
-
-        #Fix dateline problem
-        if self.outgrid == 'L44_025_REG_GLO':
-            delx=0.25
-            ddelx=3*delx
-            Uf[:,1439] = Uf[:,1438] + delx*(Uf[:,1]-Uf[:,1438])/ddelx
-            Uf[:,0] = Uf[:,1438] + 2*delx*(Uf[:,1]-Uf[:,1438])/ddelx
-           
-        
-        return Uf,Vf
+        uv = np.where(uv < 200, uv, np.nan)
+        uv_reg = remap(self._weights(method, uv=True), uv)
+        nreg = uv_reg.shape[0] // 2
+        dateline = (method == 'linear')
+        return self._to_target(uv_reg[:nreg], udata.shape[:-2], dateline), \
+               self._to_target(uv_reg[nreg:], vdata.shape[:-2], dateline)
+
+    def _uv_operator(self, method='linear'):
+        '''
+        Compose the fused sparse operator for vector interpolation.
+
+        The operator maps the stacked (U, V) fields on the source grid to the stacked
+        (u, v) fields on the target grid. It applies in sequence the sea-over-land filling
+        of the border points, the interpolation of U and V to the T points (linear for 
+        the conservative method), the rotation with `tangle` and the interpolation to the target grid with `method`. 
+        Target points depending on points without values are left without weights.
+        '''
+        ops = []
+        invalid = np.zeros(len(self.latlon), dtype=bool)
+        for stencil, tri, index in ((self.stencil_U, self.tri_sea_U, self.sea_index_U), \
+                                    (self.stencil_V, self.tri_sea_V, self.sea_index_V)):
+            F = fill_weights(*stencil, self.period)[np.flatnonzero(np.asarray(index))]
+            if method in ('linear', 'conservative'):
+                W = linear_weights(tri, self.latlon)
+            elif method == 'nearest':
+                W = nearest_weights(tri.points, self.latlon)
+            else:
+                W = nearest_weights(tri.points, self.latlon, k=IDW_NEIGHBOURS, power=IDW_POWER)
+            ops.append(W @ F)
+            # T points depending on points without values
+            invalid |= (np.diff(W.indptr) == 0) | (_pattern(W) @ (np.diff(F.indptr) == 0) > 0)
+
+        fac = np.deg2rad(np.asarray(self.tangle).ravel()[np.asarray(self.sea_index)])
+        C = sparse.diags(np.cos(fac))
+        S = sparse.diags(np.sin(fac))
+        WT = self._weights(method)
+        A = sparse.bmat([[WT @ C @ ops[0], -(WT @ S @ ops[1])], \
+                         [WT @ S @ ops[0], WT @ C @ ops[1]]], format='csr')
+        bad = (_pattern(WT) @ invalid) > 0
+        A = sparse.diags((~np.concatenate([bad, bad])).astype(float)) @ A
+        A.eliminate_zeros()
+        return A.tocsr()
     
     def to_file(self, filename):
         '''
@@ -502,13 +871,64 @@ class Ocean_Interpolator():
         with gzip.open(filename, 'wb') as output:  # Overwrites any existing file.
             pickle.dump(self, output, pickle.HIGHEST_PROTOCOL)
 
+    def to_compact(self, dirname):
+        '''
+        This method writes to the directory `dirname` only the information 
+        needed for the interpolation with `interp_T` and `interp_UV`, the weights and the sea indices 
+        as `numpy` arrays and the grid information as JSON.
+
+        The arrays are stored uncompressed as `.npy` files, therefore they can be memory mapped
+        and shared by many processes. The interpolator is read back with :func:`from_compact`.
+        Only the methods in `built_methods` are written, with their operators for (U,V).
+
+        Parameters
+        ==========
+        dirname:
+            Directory for the interpolator. It is written in a temporary directory and
+            then moved in place, an existing interpolator is replaced without overwriting
+            the files that other processes may have memory mapped
+
+        Returns
+        =======
+        moved:
+            False if `dirname` was written meanwhile by another process, its interpolator is kept
+
+        Examples
+        ========
+
+        >>> w.to_compact('L75_025_TRP_GLO-L44_025_REG_GLO_1')
+        >>> w = zint.from_compact('L75_025_TRP_GLO-L44_025_REG_GLO_1')
+        '''
+        tmp = dirname + f'.tmp{os.getpid()}'
+        os.makedirs(tmp, exist_ok=True)
+        arrays = {'sea_index': np.asarray(self.sea_index), 'sea_index_reg': np.asarray(self.sea_index_reg), \
+                  'latlon': self.latlon, 'latlon_reg': self.latlon_reg, 'mask_reg': self.mask_reg.values, \
+                  'lat': self.mask_reg.lat.values, 'lon': self.mask_reg.lon.values}
+        methods = self.built_methods()
+        matrices = {k: self._weights(m, uv) for m in methods for uv, k in enumerate(WEIGHTS[m])}
+        for k, W in matrices.items():
+            arrays.update({k + '.data': W.data, k + '.indices': W.indices, k + '.indptr': W.indptr})
+        for k, a in arrays.items():
+            np.save(os.path.join(tmp, k + '.npy'), a)
+
+        meta = {'format': COMPACT_FORMAT, 'version': COMPACT_VERSION, 'name': self.name, \
+                'ingrid': self.ingrid, 'outgrid': self.outgrid, 'level': self.level, \
+                'window': self.window, 'period': self.period, 'cent_long': self.cent_long, \
+                'methods': methods, 'matrices': {k: W.shape for k, W in matrices.items()}}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+        moved = _replace_dir(tmp, dirname)
+        if not moved:
+            print(f' Interpolator in {dirname} written meanwhile by another process, it is kept')
+        return moved
+
     def mask_sea_over_land(self,mask):
         '''
         Mask border point for `Sea over land`.
 
-        Sea over land is obtained by forward and backward filling NaN land
-        value with an arbitrary value, then athey are masked to reveal only the 
-        coastal points.
+        The border points are the land points next to a sea point
+        along `x` or `y`, they are found by shifting the sea mask by one point
+        in the four directions.
 
         Parameters
         ==========
@@ -519,79 +939,65 @@ class Ocean_Interpolator():
         =======
         border:
             border mask
+        um:
+            mask of sea and border points
 
         '''
-        masknan=xr.where(mask != 0, 1, np.nan)
-        um1 = masknan.ffill(dim='x',limit=1).fillna(0.)+  masknan.bfill(dim='x',limit=1).fillna(0.)- 2*masknan.fillna(0)
-        um2 = masknan.ffill(dim='y',limit=1).fillna(0.)+  masknan.bfill(dim='y',limit=1).fillna(0.)- 2*masknan.fillna(0)
-        bord = (um1+um2)/2
-        um = bord + masknan.fillna(0)
-        um = xr.where(um!=0, 1,np.nan)
-        mb = xr.where(bord !=0, 1,np.nan)
+        sea = (mask != 0).values
+        near = np.zeros_like(sea)
+        for dim in ('x', 'y'):
+            ax = mask.get_axis_num(dim)
+            lo = [slice(None)] * sea.ndim
+            hi = [slice(None)] * sea.ndim
+            lo[ax] = slice(None, -1)
+            hi[ax] = slice(1, None)
+            near[tuple(hi)] |= sea[tuple(lo)]
+            near[tuple(lo)] |= sea[tuple(hi)]
+        bord = mask.copy(data=near & ~sea)
+        mb = xr.where(bord, 1, np.nan)
+        um = xr.where(bord | (mask != 0), 1, np.nan)
 
         return mb, um
 
     def _resolve_grid(self,ingrid,level,verbose=False):
         '''
         Internal routine to resolve grid informations
+
+        The grids are taken from `grid_registry`, that reads the mask
+        and coordinates files only once per process.
         '''
         
-        if ingrid == 'L75_025_TRP_GLO':
-            print(f' Tripolar L75 0.25 Grid -- {ingrid}')  
-            grid = xr.open_dataset(self.mdir + '/L75_025_TRP_GLO/tmask_UVT_latlon_coordinates.nc').sel(z=level)
-            geo = xr.open_dataset(self.mdir + '/L75_025_TRP_GLO/NEMO_coordinates.nc')
-            angle = xr.open_dataset(self.mdir + '/L75_025_TRP_GLO/ORCA025L75_angle.nc')
-            struct={'tmask': grid.tmask, 'umask': grid.umask,'vmask': grid.vmask, 'tangle': angle.tangle, \
-                    'lonT': geo.glamt,'latT':geo.gphit,'lonU':geo.glamu, \
-                    'latU':geo.gphiu,'lonV':geo.glamv,'latV':geo.gphiv  }
-        
-        elif ingrid == 'L44_025_TRP_GLO':
-            print(f' Tripolar L44 0.25 Grid -- {ingrid}')
-            grid = xr.open_dataset(self.mdir + '/L44_025_TRP_GLO/tmask44_UVT_latlon_coordinates.nc').sel(z=level)
-            angle = xr.open_dataset(self.mdir + '/L75_025_TRP_GLO/ORCA025L75_angle.nc')
-            geo = xr.open_dataset(self.mdir + '/L75_025_TRP_GLO/NEMO_coordinates.nc')
-            struct={'tmask': grid.tmask, 'umask': grid.umask,'vmask': grid.vmask, 'tangle': angle.tangle, \
-                    'lonT': geo.glamt,'latT':geo.gphit,'lonU':geo.glamu, \
-                    'latU':geo.gphiu,'lonV':geo.glamv,'latV':geo.gphiv  }
-    
-        elif ingrid == 'L75_025_REG_GLO':
-            print(f' Regular L75 0.25 Lat-Lon Grid -- {ingrid}')
-            grid = xr.open_dataset(self.mdir + '/L75_025_REG_GLO/GLO-MFC_001_025_mask_bathy.nc').sel(z=level). \
-                rename({'longitude':'T_lon','latitude':'T_lat'})
-            struct={'tmask': grid.mask, 'tangle': None }
-        
-        elif ingrid == 'L44_025_REG_GLO':
-            print(f' Regular L44 0.25 Lat-Lon Grid from WOA -- {ingrid}')
-            grid = xr.open_dataset(self.mdir + '/WOA/m025x025L44.nc').sel(depth=level)
-            cent_long = 720
-            struct={'tmask': grid.m025x025L44, 'tangle': None ,'cent_long' : cent_long}
-        
-        else:
-             SystemError(f'Wrong Option in _resolve_grid --> {ingrid}')  
+        struct = grid_registry.resolve(ingrid, level)
         
         if verbose:
             print(f'Elements of {ingrid} extracted \n ')
             for i in struct.keys():
               print(f' {i} \n')
         return struct
-    def fill_sea_over_land(self,U,u_mask):
+    def fill_sea_over_land(self,U,u_mask,u_border=None):
         '''
         Put values Sea over land.
 
         Using the mask of the border points, the border points are filled 
-        with the convolution in 2D, using a window of width `window`, here
-        The min_periods value is controlling the minimum number of points
+        with the average of the valid sea points in a window of width `window`, here
+        The `period` value is controlling the minimum number of points
         within the window that is necessary to yield a result.
 
         They can be fixed as attributes of the interpolator
 
+        The average is a sparse stencil over the border points only, 
+        computed once for each mask. The field can have leading dimensions, e.g. `time`.
+
         Parameters
         ==========
 
         U:
-            Field to be treated
+            Field to be treated (..., y, x)
         u_mask:
             Mask for the field
+        u_border:
+            Mask of the border points, default `maskub` for `masku` and `maskvb` for `maskv`.
+            It is needed for other masks
 
         Returns
         =======
@@ -599,38 +1005,1153 @@ class Ocean_Interpolator():
             Filled array
         '''
         
-        r = U.rolling(x=self.window, y=self.window, min_periods=self.period,center=True)
-        r1=r.mean()
-        
-        border = ~np.isnan(self.maskub).drop_vars({'lat','lon'}).stack(ind=self.maskub.dims)
-        UU=U.stack(ind=U.dims)
-        rs = r1.stack(ind=r1.dims)
-        UU[border] = rs[border]
-
-        UUU = UU.unstack()
+        if u_border is None:
+            if u_mask is self.masku:
+                u_border = self.maskub
+            elif u_mask is self.maskv:
+                u_border = self.maskvb
+            else:
+                raise ValueError(' fill_sea_over_land needs u_border for masks other than masku and maskv')
+        if u_border is self.maskub:
+            index, S = self.stencil_U
+        elif u_border is self.maskvb:
+            index, S = self.stencil_V
+        else:
+            index, S = self._stencil(u_mask, u_border)
+
+        U = U.transpose(..., 'y', 'x')
+        data = U.values.reshape(-1, S.shape[1]).T
+        valid = np.isfinite(data)
+        total = S @ np.where(valid, data, 0.)
+        count = S @ valid.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data = data.copy()
+            data[index] = np.where(count >= self.period, total / count, np.nan)
+
+        UUU = U.copy(data=data.T.reshape(U.shape))
         UUU = UUU.assign_coords({'lon':u_mask.lon,'lat':u_mask.lat})
 
         return UUU
+
+    def _stencil(self, mask, bmask):
+        '''
+        Border points and sea-over-land stencil of the mask `mask` with border `bmask`
+        '''
+        border = bmask.notnull().values
+        sea = mask.notnull().values & ~border
+        return border_stencil(sea, border, self.window)
+    
+
+class Ocean_Interpolator3D():
+    """This class creates interpolators of ocean fields for many depth levels.
+
+    The mask files are read once for all `levels`, then an :class:`Ocean_Interpolator`
+    is built for each level. Consecutive levels with identical masks on the source 
+    and target grids share the same interpolator, the triangulations and the weights
+    are computed only when the masks change.
+
+    Parameters
+    ----------
+
+    src_grid_name : str
+        Source grid
+    tgt_grid_name : str
+        Target grid
+    levels : list
+        Depth levels of the interpolator
+    window : int
+        Window for sea over land
+    period : int
+        Minimum number of points in the sea-over-land process
+    verbose: bool
+        Lots of output
+    methods : tuple
+        Methods built at construction, see `Ocean_Interpolator`
+
+    Attributes
+    ----------
+
+    levels :
+        Depth levels
+    mdir :
+        Directory for masks files
+    interp :
+        List of the distinct `Ocean_Interpolator`
+    index :
+        Index in `interp` of the interpolator for each level
+    ingrid :
+        Input Grid
+    outgrid :
+        Output Grid
+    name :
+        Name of the Interpolator Object
+
+    Examples    
+    --------    
+    Create the interpolator for the first 50 levels
+
+    >>> w = zint.Ocean_Interpolator3D('L75_025_TRP_GLO','L44_025_REG_GLO',levels=range(1,51))
+    
+    Interpolate temperature with dimensions (time, deptht, y, x)
+
+    >>> target_xarray = w.interp_T(src_xarray, dim='deptht')
+    """
+
+    __slots__ = ('levels','interp','index','ingrid','outgrid','name','mdir')
+
+    def __init__(self, src_grid_name, tgt_grid_name, levels, verbose=False, window=3, period=1, methods=('linear',)):
+        self.name = 'Ocean 3D Interpolator'
+        self.ingrid = src_grid_name
+        self.outgrid = tgt_grid_name
+        self.levels = list(levels)
+        self.mdir = grid_registry.mdir
+
+        # Read the grids for all levels at once
+        s_in = grid_registry.resolve(src_grid_name, self.levels)
+        s_out = grid_registry.resolve(tgt_grid_name, self.levels)
+
+        self.interp = []
+        self.index = []
+        previous = None
+        for i, level in enumerate(self.levels):
+            lev_in = _level_struct(s_in, i)
+            lev_out = _level_struct(s_out, i)
+            masks = [np.array(lev_in[k]) for k in ('tmask', 'umask', 'vmask') if k in lev_in] + [np.array(lev_out['tmask'])]
+            if previous is not None and all(np.array_equal(a, b) for a, b in zip(masks, previous)):
+                print(f' Level {level} has the same masks of the previous level')
+            else:
+                self.interp.append(Ocean_Interpolator(src_grid_name, tgt_grid_name, level=level, verbose=verbose, \
+                                    window=window, period=period, s_in=lev_in, s_out=lev_out, methods=methods))
+            self.index.append(len(self.interp) - 1)
+            previous = masks
+
+    def __repr__(self):
+        '''  Printing other info '''
+        print(f' 3D Interpolator for T,U,V GLORS data from {self.ingrid} to {self.outgrid}')
+        print(f' {len(self.levels)} levels, {len(self.interp)} distinct interpolators')
+        return '\n'
+
+    def interp_T(self, xdata, dim='deptht', method='linear', chunks=None):
+        '''
+        Perform interpolation for T Grid point to the target grid for all levels.
+
+        The levels sharing the same interpolator are interpolated together.
+
+        Parameters
+        ----------
+        xdata :  xarray
+            Array to be interpolated with dimensions (..., `dim`, y, x), the
+            elements along `dim` correspond to `levels`
+        dim : str
+            Name of the vertical dimension
+        method : str    
+            Method for interpolation, see `Ocean_Interpolator.interp_T`
+        chunks : dict
+            Chunks for the leading dimensions to interpolate with `dask`
+
+        Returns
+        -------
+        out :  xarray
+            Interpolated xarray on the target grid (..., `dim`, lat, lon)
+        '''
+        if xdata.sizes[dim] != len(self.levels):
+            raise ValueError(f' Error in interp_T , {dim} has {xdata.sizes[dim]} levels, the interpolator {len(self.levels)}')
+
+        index = np.asarray(self.index)
+        out = []
+        order = []
+        for k, w in enumerate(self.interp):
+            lev = np.flatnonzero(index == k)
+            res = w.interp_T(xdata.isel({dim: lev}), method=method, chunks=chunks)
+            out.append(res.drop_vars([c for c in w.mask_reg.coords if c not in ('lat', 'lon')]))
+            order.append(lev)
+        out = xr.concat(out, dim=dim)
+        return out.isel({dim: np.argsort(np.concatenate(order))})
+
+
+class Vertical_Interpolator():
+    """ This class interpolates fields from the vertical levels `levels` to the levels `target`.
+
+    The bracketing levels and the linear weights of each target level are computed once,
+    then the interpolation of whole arrays (..., `dim`, y, x) is done at once with 
+    two gathers along `dim`. Arrays backed by `dask` are interpolated lazily chunk by chunk.
+
+    It can be used for standard depths of ocean fields and for standard pressure levels of 
+    atmospheric fields, in the latter case the interpolation is usually linear in log(p).
+
+    Target levels outside the range of `levels` are NaN. On ocean grids the points below the 
+    bottom are NaN, or they are masked with the mask of the source levels, target levels between 
+    the last sea level and the bottom are NaN unless `bottom='nearest'`, that assigns the value
+    of the last sea level.
+
+    Parameters
+    ----------
+    levels : 
+        Source levels, monotonic increasing or decreasing
+    target :
+        Target levels
+    dim : str
+        Name of the vertical dimension
+    log : bool
+        Interpolate linearly in the logarithm of the levels, e.g. for pressure
+
+    Attributes
+    ----------
+    name : str
+        Name of the interpolator
+    levels : 
+        Source levels
+    target :
+        Target levels
+    dim : str
+        Name of the vertical dimension
+    log : bool
+        Interpolation in the logarithm of the levels
+    lower : 
+        Index of the bracketing source level with the smaller value, for each target level
+    upper :
+        Index of the bracketing source level with the larger value, for each target level
+    weight :
+        Weight of `upper`, NaN for target levels outside the source levels
+
+    Examples    
+    --------    
+    Standard depths of the ocean temperature with dimensions (time, deptht, y, x)
+
+    >>> v = zint.Vertical_Interpolator(temp.deptht, [10, 50, 100, 200, 500, 1000], dim='deptht')
+    >>> out = v.interp(temp, mask=tmask)
+
+    Standard pressure levels
+
+    >>> v = zint.Vertical_Interpolator(U.pressure, np.arange(100, 1000, 50), dim='pressure', log=True)
+    >>> out = v.interp(U)
+    """
+
+    __slots__ = ('name','levels','target','dim','log','lower','upper','weight')
+
+    def __init__(self, levels, target, dim='deptht', log=False):
+        self.name = 'Vertical Interpolator'
+        self.levels = np.asarray(levels, dtype=float)
+        self.target = np.atleast_1d(np.asarray(target, dtype=float))
+        self.dim = dim
+        self.log = log
+        if log:
+            self.lower, self.upper, self.weight = vertical_weights(np.log(self.levels), np.log(self.target))
+        else:
+            self.lower, self.upper, self.weight = vertical_weights(self.levels, self.target)
+
+    def __repr__(self):
+        '''  Printing other info '''
+        print(f' Vertical Interpolator along {self.dim}, {len(self.levels)} --> {len(self.target)} levels')
+        print(f' Target levels {self.target}')
+        return '\n'
+
+    def interp(self, xdata, mask=None, bottom='nan'):
+        '''
+        Interpolate `xdata` to the target levels.
+
+        Parameters
+        ----------
+        xdata :  xarray
+            Array to be interpolated, with dimension `dim` corresponding to `levels`
+        mask : xarray
+            Mask of the source levels, zero or NaN on land, e.g. `tmask`. If not given
+            the points with NaN in `xdata` are considered land
+        bottom : str
+            * 'nan', target levels below the last sea level are NaN
+            * 'nearest', target levels between the last sea level and the next level 
+              take the value of the last sea level
+
+        Returns
+        -------
+        out :  xarray
+            Interpolated xarray with `dim` along the target levels
+        '''
+        if xdata.sizes[self.dim] != len(self.levels):
+            raise ValueError(f' Error in interp , {self.dim} has {xdata.sizes[self.dim]} levels, the interpolator {len(self.levels)}')
+        if bottom not in ('nan', 'nearest'):
+            raise ValueError(f'Wrong option for bottom --> {bottom}')
+        if mask is not None:
+            xdata = xdata.where(mask.fillna(0) != 0)
+        if xdata.chunks is not None:
+            xdata = xdata.chunk({self.dim: -1})
+
+        out = xr.apply_ufunc(_vertical_block, xdata, 
+                             kwargs={'lower': self.lower, 'upper': self.upper, 'weight': self.weight, 
+                                     'nearest': bottom == 'nearest'},
+                             input_core_dims=[[self.dim]], output_core_dims=[[self.dim]],
+                             exclude_dims={self.dim}, dask='parallelized', output_dtypes=[float],
+                             dask_gufunc_kwargs={'output_sizes': {self.dim: len(self.target)}})
+        out = out.transpose(*xdata.dims)
+        return out.assign_coords({self.dim: self.target})
+
+    def target_mask(self, mask, bottom='nan'):
+        '''
+        Mask of the target levels from the mask of the source levels.
+
+        Parameters
+        ----------
+        mask : xarray
+            Mask of the source levels, zero or NaN on land
+        bottom : str
+            As in `interp`
+
+        Returns
+        -------
+        mask : xarray
+            Mask on the target levels, 1 on sea and 0 on land
+        '''
+        out = self.interp(xr.ones_like(mask, dtype=float), mask=mask, bottom=bottom)
+        return out.notnull().astype(np.int8)
+
+
+def vertical_weights(x, xt):
+    '''
+    Bracketing levels and weights of the linear interpolation from `x` to `xt`
+
+    Parameters
+    ----------
+    x : 
+        Source levels, monotonic
+    xt :
+        Target levels
+
+    Returns
+    -------
+    lower, upper :
+        Indices in `x` of the bracketing levels of each target level
+    weight :
+        Weight of `upper`, NaN outside the range of `x`
+    '''
+    order = np.argsort(x)
+    xs = x[order]
+    if len(xs) < 2:
+        raise ValueError(f'At least two source levels are needed --> {x}')
+    i = np.clip(np.searchsorted(xs, xt, 'right') - 1, 0, len(xs) - 2)
+    t = (xt - xs[i]) / (xs[i + 1] - xs[i])
+    t[(t < 0) | (t > 1)] = np.nan
+    return order[i], order[i + 1], t
+
+def _vertical_block(x, lower, upper, weight, nearest=False):
+    '''Interpolate `x` (..., levels) with the bracketing levels and weights'''
+    x0 = np.take(x, lower, axis=-1)
+    x1 = np.take(x, upper, axis=-1)
+    out = x0 + weight * (x1 - x0)
+    # exact levels are not affected by NaN in the other level
+    out = np.where(weight == 0, x0, np.where(weight == 1, x1, out))
+    if nearest:
+        # the other level is below the bottom
+        out = np.where(np.isnan(x1) & ~np.isnan(weight), x0, out)
+        out = np.where(np.isnan(out) & ~np.isnan(weight), x1, out)
+    return out
+
+
+class Interp_Store():
+    """ This class manages ocean interpolators stored on disk.
+
+    The interpolators are saved with `Ocean_Interpolator.to_compact` in the directory `root`
+    and memory mapped with `from_compact`. The key includes the fingerprint of the grid files,
+    see `Grid_Registry.fingerprint`.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the store. If not given it is taken from the 
+        environment variable `ZAPATA_INTERP`, or it defaults to `~/.zapata/interpolators`
+
+    Attributes
+    ----------
+    root : str
+        Directory of the store
+
+    Examples    
+    --------    
+    Build (or retrieve) the interpolator from the tripolar to the regular grid 
+
+    >>> store = Interp_Store()
+    >>> w = store.get('L75_025_TRP_GLO','L44_025_REG_GLO',level=1)
+    >>> out = w.interp_T(sst)
+
+    """
+
+    __slots__ = ('root',)
+
+    def __init__(self, root=None):
+        self.root = zlib.store_root(root, 'ZAPATA_INTERP', '.zapata/interpolators')
+
+    def __repr__(self):
+        '''  Printing Information '''
+        print(f' Interpolator store at {self.root}')
+        for key in self.list():
+            print(f'   {key}')
+        return '\n'
+
+    def fingerprint(self, *grids):
+        '''
+        Fingerprint of the mask files of `grids`, see `Grid_Registry.fingerprint`.
+        '''
+        return grid_registry.fingerprint(*grids)
+
+    def key(self, src_grid_name, tgt_grid_name, level=1, window=3, period=1):
+        '''Key identifying an interpolator in the store.'''
+        fp = self.fingerprint(src_grid_name, tgt_grid_name)
+        return '_'.join([src_grid_name, tgt_grid_name, f'L{level}', f'w{window}', f'p{period}', fp])
+
+    def path(self, src_grid_name, tgt_grid_name, level=1, window=3, period=1):
+        '''Directory of the interpolator in the store.'''
+        return self.root + '/' + self.key(src_grid_name, tgt_grid_name, level, window, period)
+
+    def list(self):
+        '''List the keys of the stored interpolators.'''
+        return sorted([f for f in os.listdir(self.root) if os.path.isfile(self.root + '/' + f + '/meta.json')])
+
+    def get(self, src_grid_name, tgt_grid_name, level=1, window=3, period=1, methods=('linear',), \
+            recompute=False, verbose=False):
+        '''
+        Retrieve an interpolator from the store, building it if necessary.
+
+        Parameters
+        ----------
+        src_grid_name :
+            Source grid
+        tgt_grid_name :
+            Target grid
+        level : 
+            Depth level of the interpolator
+        window : int
+            Window for sea over land
+        period : int
+            Minimum number of points in the sea-over-land process
+        methods : tuple
+            Interpolation methods needed, a stored interpolator without them is rebuilt
+        recompute : bool
+            Rebuild the interpolator even if it is in the store
+        verbose : bool
+            Tons of output
+
+        Jobs that build the same interpolator at the same time keep the interpolator 
+        of the first one that writes it in the store.
+
+        Returns
+        -------
+        w : Ocean_Interpolator
+            Interpolator memory mapped from the store, or the interpolator just built
+            if the store holds an interpolator without `methods`
+        '''
+        dirname = self.path(src_grid_name, tgt_grid_name, level, window, period)
+        if os.path.isfile(dirname + '/meta.json') and not recompute:
+            try:
+                w = from_compact(dirname)
+                missing = [m for m in methods if m not in w.built_methods()]
+                if not missing:
+                    if verbose:
+                        print(f' Interpolator read from {dirname}')
+                    return w
+                print(f' Rebuilding interpolator, methods {missing} not stored')
+                methods = tuple(w.built_methods()) + tuple(missing)
+            except (ValueError, OSError) as e:
+                print(f' Rebuilding interpolator, {e}')
+
+        w = Ocean_Interpolator(src_grid_name, tgt_grid_name, level=level, verbose=verbose, window=window, period=period, \
+                               methods=methods)
+        if w.to_compact(dirname) and verbose:
+            print(f' Interpolator written to {dirname}')
+        # The interpolator in the store may have been written by another job
+        try:
+            stored = from_compact(dirname)
+        except (ValueError, OSError) as e:
+            print(f' Interpolator not read from the store, {e}')
+            return w
+        if any(m not in stored.built_methods() for m in methods):
+            return w
+        return stored
+
+    def remove(self, src_grid_name, tgt_grid_name, level=1, window=3, period=1):
+        '''Remove an interpolator from the store.'''
+        dirname = self.path(src_grid_name, tgt_grid_name, level, window, period)
+        if os.path.isdir(dirname):
+            for f in os.listdir(dirname):
+                os.remove(dirname + '/' + f)
+            os.rmdir(dirname)
     
 
+class Grid_Registry():
+    """ This class holds the ocean grids used by the interpolators.
+
+    For each grid the registry keeps the coordinates, the angles and the masks
+    of all levels. The files of a grid are read the first time the grid is requested 
+    and the arrays are then shared by all the interpolators of the process, 
+    selecting the requested levels from the arrays in memory.
+
+    The grids are described by a dictionary with the entries
+
+    * `kind` -- 'tripolar' or 'regular'
+    * `mask` -- mask file, with the variables `tmask`, `umask`, `vmask` for tripolar grids
+    * `mask_var` -- name of the mask variable for regular grids
+    * `coords` -- coordinates file of tripolar grids (`glamt`, `gphit`, ...)
+    * `angle` -- angles file of tripolar grids (`tangle`)
+    * `level_dim` -- name of the vertical dimension in the mask file
+    * `rename` -- renaming of the coordinates of the mask (optional)
+    * `cent_long` -- central longitude (optional)
+    * `description` -- description of the grid (optional)
+
+    The files are relative to `mdir`, unless they are given with an absolute path.
+    The default grids are in `GRIDS`, other grids can be added with `register` or 
+    from the `grids` entry of a dataset in the catalogue with `from_catalogue`.
+
+    If `cache` is given, the arrays of each grid are written there as `.npy` files the 
+    first time the grid is read from the NetCDF files, later processes memory map them
+    from the cache. The cache of a grid is keyed by the fingerprint of its files.
+
+    Parameters
+    ----------
+    mdir : str
+        Directory of the grid files, default `MASK_DIR`
+    cache : str
+        Directory of the memory mapped cache. If not given it is taken from the
+        environment variable `ZAPATA_GRIDS`, if this is not set the cache is not used
+
+    Attributes
+    ----------
+    specs : dict
+        Description of the registered grids
+    grids : dict
+        Arrays of the grids read so far
+    mdir : str
+        Directory of the grid files
+    cache : str
+        Directory of the cache
+
+    Examples    
+    --------    
+    The module instance `grid_registry` is used by the interpolators
+
+    >>> zint.grid_registry.from_catalogue('C-GLORSv7')
+    >>> zint.grid_registry.cache = '/scratch/grids'
+    >>> s = zint.grid_registry.resolve('L75_025_TRP_GLO', level=[1, 2, 3])
+    """
+
+    __slots__ = ('specs','grids','mdir','cache')
+
+    def __init__(self, mdir=None, cache=None):
+        self.specs = {k: dict(v) for k, v in GRIDS.items()}
+        self.grids = {}
+        self.mdir = MASK_DIR if mdir is None else mdir
+        self.cache = os.environ.get('ZAPATA_GRIDS') if cache is None else cache
+
+    def __repr__(self):
+        '''  Printing Information '''
+        print(f' Grid registry, files in {self.mdir}, cache {self.cache}')
+        for name, spec in self.specs.items():
+            status = 'loaded' if name in self.grids else ''
+            print(f'   {name} : {spec.get("description", spec["kind"])} {status}')
+        return '\n'
+
+    def register(self, name, spec):
+        '''
+        Add the grid `name` described by the dictionary `spec`, replacing a grid with the same name.
+        '''
+        if spec.get('kind') not in ('tripolar', 'regular'):
+            raise ValueError(f'Wrong kind of grid {name} --> {spec.get("kind")}')
+        self.specs[name] = dict(spec)
+        self.grids.pop(name, None)
+
+    def from_catalogue(self, dataset):
+        '''
+        Register the grids of the `grids` entry of `dataset` in the catalogue, see `zapata.data`.
+        '''
+        import zapata.data as zdat
+
+        datacat = zdat.inquire_catalogue(dataset)
+        for name, spec in datacat.get('grids', {}).items():
+            self.register(name, spec)
+        return list(datacat.get('grids', {}))
+
+    def files(self, name):
+        '''Dictionary of the files of grid `name`.'''
+        spec = self._spec(name)
+        return {k: os.path.join(self.mdir, spec[k]) for k in ('mask', 'coords', 'angle') if spec.get(k)}
+
+    def fingerprint(self, *names):
+        '''
+        Fingerprint of the files of the grids `names`, from their size and modification time.
+        '''
+        h = hashlib.sha1()
+        for name in names:
+            for f in self.files(name).values() if name in self.specs else []:
+                if os.path.isfile(f):
+                    st = os.stat(f)
+                    h.update(f'{os.path.basename(f)}:{st.st_size}:{st.st_mtime_ns};'.encode())
+                else:
+                    h.update(f'{os.path.basename(f)}:missing;'.encode())
+        return h.hexdigest()[:12]
+
+    def get(self, name):
+        '''
+        Arrays of grid `name` for all levels, read at the first request.
+        '''
+        if name not in self.grids:
+            grid = None
+            dirname = None
+            if self.cache is not None:
+                dirname = os.path.join(self.cache, f'{name}_{self.fingerprint(name)}')
+                grid = _read_grid_cache(dirname)
+            if grid is None:
+                grid = self._read(name)
+                if dirname is not None:
+                    _write_grid_cache(dirname, grid)
+                    grid = _read_grid_cache(dirname)
+            self.grids[name] = grid
+        return self.grids[name]
+
+    def resolve(self, name, level):
+        '''
+        Structure of grid `name` for `level`, as used by `Ocean_Interpolator`
+
+        Parameters
+        ----------
+        name : str
+            Name of the grid
+        level : int or list
+            Level or list of levels
+
+        Returns
+        -------
+        struct : dict
+            Masks for `level` and coordinates of the grid. The masks are copies,
+            the coordinates are shared with the registry.
+        '''
+        spec = self._spec(name)
+        print(f' {spec.get("description", spec["kind"])} -- {name}')
+        dim = spec.get('level_dim', 'z')
+        struct = {}
+        for k, v in self.get(name).items():
+            if dim in v.dims:
+                v = v.sel({dim: level}).copy()
+            struct[k] = v
+        if spec['kind'] == 'regular':
+            struct['tangle'] = None
+            struct['cent_long'] = spec.get('cent_long')
+        return struct
+
+    def clear(self, name=None):
+        '''Release the arrays of grid `name`, or of all grids.'''
+        if name is None:
+            self.grids.clear()
+        else:
+            self.grids.pop(name, None)
+
+    def _spec(self, name):
+        if name not in self.specs:
+            raise ValueError(f'Grid not in the registry --> {name}')
+        return self.specs[name]
+
+    def _read(self, name):
+        '''Read the arrays of grid `name` from the NetCDF files.'''
+        spec = self._spec(name)
+        files = self.files(name)
+        print(f' Reading grid {name} from {files["mask"]}')
+        mask = xr.open_dataset(files['mask'])
+        if spec['kind'] == 'tripolar':
+            geo = xr.open_dataset(files['coords'])
+            angle = xr.open_dataset(files['angle'])
+            grid = {k: mask[k] for k in ('tmask', 'umask', 'vmask')}
+            grid['tangle'] = angle.tangle
+            grid.update({k: geo[v] for k, v in NEMO_COORDS.items()})
+        else:
+            grid = {'tmask': mask[spec['mask_var']].rename(spec.get('rename') or {})}
+        grid = {k: v.load() for k, v in grid.items()}
+        for k in ('tmask', 'umask', 'vmask'):
+            if k in grid:
+                grid[k] = _small_mask(grid[k])
+        return grid
+
+
+# Module registry shared by all the ocean interpolators
+grid_registry = Grid_Registry()
+
+# Cache format of the grid registry
+GRID_CACHE_FORMAT = 'zapata-grid'
+GRID_CACHE_VERSION = 1
+
+def _small_mask(mask):
+    '''
+    Store a 0/1 mask as `int8`, masks with other values are returned unchanged.
+    '''
+    values = mask.values
+    if values.dtype != np.int8 and np.isin(values, (0, 1)).all():
+        mask = mask.copy(data=values.astype(np.int8))
+    return mask
+
+def _write_grid_cache(dirname, grid):
+    '''
+    Write the DataArrays of `grid` in `dirname` as `.npy` files with their coordinates
+    '''
+    tmp = dirname + f'.tmp{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    meta = {'format': GRID_CACHE_FORMAT, 'version': GRID_CACHE_VERSION, 'arrays': {}}
+    for k, v in grid.items():
+        np.save(os.path.join(tmp, k + '.npy'), v.values)
+        coords = {}
+        for c, cv in v.coords.items():
+            np.save(os.path.join(tmp, f'{k}.{c}.npy'), cv.values)
+            coords[c] = list(cv.dims)
+        meta['arrays'][k] = {'name': v.name, 'dims': list(v.dims), 'coords': coords}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    try:
+        os.rename(tmp, dirname)
+    except OSError:
+        # Written meanwhile by another process
+        _remove_dir(tmp)
+
+def _remove_dir(dirname):
+    '''Remove the directory `dirname` and its files'''
+    for f in os.listdir(dirname):
+        os.remove(os.path.join(dirname, f))
+    os.rmdir(dirname)
+
+def _replace_dir(tmp, dirname):
+    '''
+    Move the directory `tmp` to `dirname`, replacing it
+
+    The files of an existing `dirname` are unlinked and not truncated, 
+    processes that memory map them keep reading the old arrays.
+    If another process writes `dirname` meanwhile, its directory is kept 
+    and `tmp` is removed.
+
+    Returns
+    =======
+    moved:
+        False if `dirname` was written by another process
+    '''
+    old = dirname + f'.old{os.getpid()}'
+    try:
+        os.rename(dirname, old)
+    except FileNotFoundError:
+        old = None
+    try:
+        os.rename(tmp, dirname)
+        moved = True
+    except OSError:
+        # Written meanwhile by another process
+        _remove_dir(tmp)
+        moved = False
+    if old is not None:
+        _remove_dir(old)
+    return moved
+
+def _read_grid_cache(dirname, mmap_mode='r'):
+    '''
+    Memory map the grid written by `_write_grid_cache`, None if it is not available
+    '''
+    try:
+        with open(os.path.join(dirname, 'meta.json')) as f:
+            meta = json.load(f)
+    except OSError:
+        return None
+    if meta.get('format') != GRID_CACHE_FORMAT or meta.get('version') != GRID_CACHE_VERSION:
+        return None
+
+    def load(k):
+        return np.load(os.path.join(dirname, k + '.npy'), mmap_mode=mmap_mode)
+
+    grid = {}
+    for k, m in meta['arrays'].items():
+        coords = {c: (dims, load(f'{k}.{c}')) for c, dims in m['coords'].items()}
+        grid[k] = xr.DataArray(load(k), dims=m['dims'], coords=coords, name=m['name'])
+    return grid
+
+def _level_struct(struct, i):
+    '''
+    Select the `i`-th level of a grid resolved by `_resolve_grid` for many levels
+    '''
+    out = {}
+    for k, v in struct.items():
+        if isinstance(v, xr.DataArray):
+            for d in ('z', 'depth'):
+                if d in v.dims:
+                    v = v.isel({d: i}).copy()
+        out[k] = v
+    return out
+
+def sea_points(mask):
+    '''
+    Coordinates and indices of the sea points of `mask`
+
+    The sea points are the points with values outside (-0.1, 0.1) that are not NaN,
+    as in `get_sea`, but they are found directly on the `numpy` arrays.
+
+    Parameters
+    ==========
+    mask:
+        Mask with coordinates `lat` and `lon`
+
+    Returns
+    =======
+    latlon:
+        Array (number of sea points, 2) of the (lat, lon) of the sea points
+    sea_index:
+        Boolean array of the sea points on the flattened mask
+    '''
+    m = mask.values.ravel()
+    with np.errstate(invalid='ignore'):
+        sea_index = (m <= -0.1) | (m >= 0.1)
+    lat = mask.lat.broadcast_like(mask).transpose(*mask.dims).values.ravel()
+    lon = mask.lon.broadcast_like(mask).transpose(*mask.dims).values.ravel()
+    latlon = np.stack([lat[sea_index], lon[sea_index]], axis=1)
+    return latlon, sea_index
+
 def get_sea(maskT):
     '''
     Obtain indexed coordinates for sea points
+
+    Kept for compatibility, the interpolators use `sea_points`.
+    '''
+    latlon, sea_index = sea_points(maskT)
+    maskT_vec = zlib.putna(-0.1,0.1,maskT).stack(ind=maskT.dims)
+    return latlon, maskT_vec.copy(data=sea_index), maskT_vec
+
+def linear_weights(tri, points):
+    '''
+    Sparse matrix of the weights for linear interpolation
+
+    The weights are the barycentric coordinates of `points` in the 
+    simplices of the triangulation `tri`. Points outside the triangulation
+    have no weights.
+
+    Parameters
+    ==========
+    tri:
+        Delaunay triangulation of the source points
+    points:
+        Target points (npoints, 2)
+    
+    Returns
+    =======
+    W:
+        Sparse CSR matrix (npoints, number of source points)
     '''
+    points = np.asarray(points)
+    simplex = tri.find_simplex(points)
+    inside = np.flatnonzero(simplex >= 0)
+    trans = tri.transform[simplex[inside]]
+    bary = np.einsum('ijk,ik->ij', trans[:, :2, :], points[inside] - trans[:, 2, :])
+    bary = np.c_[bary, 1 - bary.sum(axis=1)]
+    rows = np.repeat(inside, 3)
+    cols = tri.simplices[simplex[inside]].ravel()
+    return sparse.csr_matrix((bary.ravel(), (rows, cols)), shape=(points.shape[0], tri.npoints))
+
+def nearest_weights(points, tgt_points, k=1, power=2.):
+    '''
+    Sparse matrix of the weights for nearest point interpolation
 
-    # Try Interpolation
-    tm = zlib.putna(-0.1,0.1,maskT)
-    sea_index = ~np.isnan(tm).stack(ind=maskT.dims)
+    The `k` nearest points are found with a `cKDTree` on the Cartesian 
+    coordinates of the points on the unit sphere, distances are therefore
+    correct at high latitudes and across the dateline.
+    For `k` > 1 the points are weighted with the inverse of the distance to 
+    the power `power`.
 
-    maskT_vec = tm.stack(ind=maskT.dims)
-    land_point = maskT_vec[~sea_index]
-    sea_point = maskT_vec[sea_index]
-    land_point.name = 'Land'
-    sea_point.name = 'Sea'
+    Parameters
+    ==========
+    points:
+        Source points (npoints, 2) as (lat, lon) in degrees
+    tgt_points:
+        Target points (ntarget, 2) as (lat, lon) in degrees
+    k:
+        Number of neighbours
+    power:
+        Power of the inverse distance weighting
     
-    # Compute triangularization for sea points
-    latlon=np.asarray([sea_point.lat.data,sea_point.lon.data]).T
-    return latlon, sea_index, maskT_vec
+    Returns
+    =======
+    W:
+        Sparse CSR matrix (ntarget, npoints)
+    '''
+    tree = cKDTree(_xyz(points))
+    dist, index = tree.query(_xyz(tgt_points), k=k, workers=-1)
+    dist = dist.reshape(-1, k)
+    index = index.reshape(-1, k)
+    w = 1. / np.maximum(dist, 1.e-12)**power
+    w /= w.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(index.shape[0]), k)
+    return sparse.csr_matrix((w.ravel(), (rows, index.ravel())), shape=(index.shape[0], len(points)))
+
+def _xyz(latlon):
+    '''Cartesian coordinates on the unit sphere of (lat, lon) points in degrees'''
+    lat = np.deg2rad(np.asarray(latlon)[:, 0])
+    lon = np.deg2rad(np.asarray(latlon)[:, 1])
+    return np.c_[np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+
+def regular_edges(lat, lon):
+    '''
+    Edges of the cells of a regular grid
+
+    The edges are the midpoints between the grid points, latitudes are
+    limited to the poles and the longitudes are periodic.
+
+    Parameters
+    ==========
+    lat, lon:
+        Latitudes and longitudes of the grid points in degrees
+
+    Returns
+    =======
+    lat_edges, lon_edges:
+        Edges of the cells, with one element more than `lat` and `lon`
+    '''
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    lat_edges = np.r_[1.5 * lat[0] - 0.5 * lat[1], 0.5 * (lat[1:] + lat[:-1]), 1.5 * lat[-1] - 0.5 * lat[-2]]
+    lat_edges = np.clip(lat_edges, -90., 90.)
+    dlon = np.diff(np.r_[lon, lon[0] + 360.])
+    lon_edges = np.r_[lon[0] - 0.5 * dlon[-1], lon + 0.5 * dlon]
+    return lat_edges, lon_edges
+
+def nemo_corners(latF, lonF, halo=True):
+    '''
+    Corners of the T cells of a NEMO grid from the f-points
+
+    The corners of the cell (j,i) are the f-points (j-1,i-1), (j-1,i), (j,i), (j,i-1).
+    The cells of the first row have no corners and are set to NaN.
+
+    ORCA grids are periodic in `i` with a halo of two columns, column 0 is a copy of
+    column nx-2 and column nx-1 is a copy of column 1. The halo cells are set to NaN, 
+    so that each cell is counted once, and the cell of column 1 takes its western corners 
+    from column nx-2. Without `halo` the grid is periodic in `i` with no repeated columns.
+
+    Parameters
+    ==========
+    latF, lonF:
+        Latitudes and longitudes of the f-points (ny, nx) in degrees
+    halo:
+        True if the grid has the two columns of the ORCA halo
+
+    Returns
+    =======
+    corners:
+        Array (ny*nx, 4, 2) of the (lat, lon) of the corners in degrees
+    '''
+    F = np.stack([np.asarray(latF, dtype=float), np.asarray(lonF, dtype=float)], axis=-1)
+    ny, nx = F.shape[:2]
+    west = np.arange(nx) - 1
+    if halo:
+        west[1] = nx - 2
+    corners = []
+    for dj, di in ((1, 1), (1, 0), (0, 0), (0, 1)):
+        c = F[:, west] if di else F.copy()
+        c = np.roll(c, dj, 0)
+        c[:dj] = np.nan
+        if halo:
+            c[:, [0, nx - 1]] = np.nan
+        corners.append(c.reshape(-1, 2))
+    return np.stack(corners, axis=1)
+
+def conservative_weights(corners, lat_edges, lon_edges, chunk=50000):
+    '''
+    Sparse matrix of the weights for first order conservative remapping
+
+    The source cells are clipped with the cells of the regular target grid 
+    in the plane (longitude, sine of latitude), where the areas of the target cells
+    are exact. The overlap areas are normalized with the area of each target cell
+    covered by source cells. 
+
+    Parameters
+    ==========
+    corners:
+        Corners of the source cells (ncell, 4, 2) as (lat, lon) in degrees, ordered 
+        along the border of the cells. Cells with NaN corners are ignored.
+    lat_edges, lon_edges:
+        Edges of the target cells, as from `regular_edges`
+    chunk:
+        Number of source cells processed at once
+    
+    Returns
+    =======
+    W:
+        Sparse CSR matrix (number of target cells, ncell), the target cells
+        are ordered as (lat, lon)
+    '''
+    nlat = len(lat_edges) - 1
+    nlon = len(lon_edges) - 1
+    flip = lat_edges[0] > lat_edges[-1]
+    y_edges = np.sin(np.deg2rad(np.sort(lat_edges)))
+    x_edges = np.deg2rad(np.r_[lon_edges[:-1] - 360., lon_edges[:-1], lon_edges + 360.])
+
+    # Source cells in the (lon, sin(lat)) plane, longitudes continuous within the cell
+    lon = corners[..., 1]
+    lon = lon[:, :1] + (lon - lon[:, :1] + 180.) % 360. - 180.
+    poly = np.stack([np.deg2rad(lon), np.sin(np.deg2rad(corners[..., 0]))], axis=-1)
+    good = np.flatnonzero(np.isfinite(poly).all(axis=(1, 2)))
+
+    rows, cols, area = [], [], []
+    for start in range(0, good.size, chunk):
+        cell = good[start:start + chunk]
+        p = poly[cell]
+        i0 = np.searchsorted(x_edges, p[..., 0].min(axis=1), 'right') - 1
+        i1 = np.searchsorted(x_edges, p[..., 0].max(axis=1), 'left') - 1
+        j0 = np.clip(np.searchsorted(y_edges, p[..., 1].min(axis=1), 'right') - 1, 0, nlat - 1)
+        j1 = np.clip(np.searchsorted(y_edges, p[..., 1].max(axis=1), 'left') - 1, 0, nlat - 1)
+        ni = i1 - i0 + 1
+        count = ni * (j1 - j0 + 1)
+        pair = np.repeat(np.arange(cell.size), count)
+        k = np.arange(pair.size) - np.repeat(np.cumsum(count) - count, count)
+        ii = i0[pair] + k % ni[pair]
+        jj = j0[pair] + k // ni[pair]
+        a = _clip_area(p[pair], x_edges[ii], x_edges[ii + 1], y_edges[jj], y_edges[jj + 1])
+        keep = a > 0
+        jj = nlat - 1 - jj if flip else jj
+        rows.append(jj[keep] * nlon + ii[keep] % nlon)
+        cols.append(cell[pair[keep]])
+        area.append(a[keep])
+
+    rows, cols, area = np.concatenate(rows), np.concatenate(cols), np.concatenate(area)
+    covered = np.bincount(rows, weights=area, minlength=nlat * nlon)
+    return sparse.csr_matrix((area / covered[rows], (rows, cols)), shape=(nlat * nlon, len(corners)))
+
+def _clip_area(poly, x0, x1, y0, y1):
+    '''
+    Area of the convex polygons `poly` (n, 4, 2) clipped by the rectangles
+    [x0,x1] x [y0,y1] with the Sutherland-Hodgman algorithm
+    '''
+    nmax = 8
+    m = poly.shape[0]
+    p = np.zeros((m, nmax, 2))
+    p[:, :poly.shape[1]] = poly
+    nv = np.full(m, poly.shape[1])
+    for axis, bound, sign in ((0, x0, 1.), (0, x1, -1.), (1, y0, 1.), (1, y1, -1.)):
+        k = np.arange(nmax)
+        valid = k[None, :] < nv[:, None]
+        nxt = np.take_along_axis(p, ((k[None, :] + 1) % np.maximum(nv, 1)[:, None])[..., None], axis=1)
+        din = sign * (p[..., axis] - bound[:, None])
+        dnx = sign * (nxt[..., axis] - bound[:, None])
+        pin = din >= 0
+        cross = valid & (pin != (dnx >= 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = din / (din - dnx)
+            inter = p + t[..., None] * (nxt - p)
+        out = np.stack([p, inter], axis=2).reshape(m, 2 * nmax, 2)
+        keep = np.stack([valid & pin, cross], axis=2).reshape(m, 2 * nmax)
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :nmax]
+        p = np.take_along_axis(out, order[..., None], axis=1)
+        nv = np.minimum(keep.sum(axis=1), nmax)
+    k = np.arange(nmax)
+    valid = k[None, :] < nv[:, None]
+    nxt = np.take_along_axis(p, ((k[None, :] + 1) % np.maximum(nv, 1)[:, None])[..., None], axis=1)
+    with np.errstate(invalid='ignore'):
+        cross = p[..., 0] * nxt[..., 1] - nxt[..., 0] * p[..., 1]
+    return 0.5 * np.abs(np.where(valid, cross, 0.).sum(axis=1))
+
+def border_stencil(sea, border, window=3):
+    '''
+    Sparse stencil of the sea-over-land filling
+
+    For each border point the stencil selects the `sea` points in a centered
+    window of width `window`.
+
+    Parameters
+    ==========
+    sea:
+        Boolean array (ny, nx) of the points with values
+    border:
+        Boolean array (ny, nx) of the border points to be filled
+    window:
+        Width of the window
+
+    Returns
+    =======
+    index:
+        Flat indices of the border points
+    S:
+        Sparse CSR matrix of ones (number of border points, ny*nx)
+    '''
+    ny, nx = sea.shape
+    jb, ib = np.nonzero(border)
+    rows = []
+    cols = []
+    for dj in range(-(window // 2), window - window // 2):
+        for di in range(-(window // 2), window - window // 2):
+            j = jb + dj
+            i = ib + di
+            ok = (j >= 0) & (j < ny) & (i >= 0) & (i < nx)
+            ok[ok] = sea[j[ok], i[ok]]
+            rows.append(np.flatnonzero(ok))
+            cols.append(j[ok] * nx + i[ok])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    S = sparse.csr_matrix((np.ones(rows.size), (rows, cols)), shape=(jb.size, ny * nx))
+    return jb * nx + ib, S
+
+def fill_weights(index, S, period=1):
+    '''
+    Sparse matrix of the sea-over-land filling
+
+    The border points get the average of the sea points of the stencil `S`, 
+    if there are at least `period` of them, as in `Ocean_Interpolator.fill_sea_over_land`.
+    The other points are unchanged.
+
+    Parameters
+    ==========
+    index, S:
+        Border points and stencil from `border_stencil`
+    period:
+        Minimum number of sea points in the window
+
+    Returns
+    =======
+    F:
+        Sparse CSR matrix (number of points, number of points)
+    '''
+    n = S.shape[1]
+    count = np.diff(S.indptr)
+    B = (sparse.diags(np.where(count >= period, 1. / np.maximum(count, 1), 0.)) @ S).tocoo()
+    B.eliminate_zeros()
+    others = np.setdiff1d(np.arange(n), index)
+    rows = np.concatenate([index[B.row], others])
+    cols = np.concatenate([B.col, others])
+    data = np.concatenate([B.data, np.ones(others.size)])
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+def _remap_block(data, args):
+    '''
+    Interpolate the numpy array `data` (..., y, x) to the target grid (..., lat, lon)
+    with the weights and indices `args` from `Ocean_Interpolator._block_args`
+    '''
+    W, sea_index, sea_index_reg, shape, dateline = args
+    sea_T = data.reshape(-1, data.shape[-2] * data.shape[-1])[:, sea_index].T
+    return _to_grid(remap(W, sea_T), data.shape[:-2], sea_index_reg, shape, dateline)
+
+def _to_grid(T_reg, lead, sea_index_reg, shape, dateline=False):
+    '''
+    Put the values `T_reg` (sea points, ...) on the target grid (..., lat, lon) of shape `shape`
+    '''
+    nlat, nlon = shape
+    out = np.full((T_reg.shape[1], nlat * nlon), np.nan)
+    out[:, sea_index_reg] = T_reg.T
+    out = out.reshape(lead + (nlat, nlon))
+    #Fix dateline problem
+    if dateline:
+        delx=0.25
+        ddelx=3*delx
+        out[...,1439] = out[...,1438] + delx*(out[...,1]-out[...,1438])/ddelx
+        out[...,0] = out[...,1438] + 2*delx*(out[...,1]-out[...,1438])/ddelx
+    return out
+
+def _pattern(W):
+    '''Sparsity pattern of `W` as a matrix of ones'''
+    P = W.copy()
+    P.data = np.ones_like(P.data)
+    return P
+
+def remap(W, data):
+    '''
+    Apply the interpolation weights `W` to `data`
+
+    Points without weights are set to NaN.
+    '''
+    out = W @ data
+    out[np.diff(W.indptr) == 0] = np.nan
+    return out
 def from_file(file):
     '''
     Read interpolator object from `file`
@@ -640,4 +2161,47 @@ def from_file(file):
         w = pickle.load(input)
     return w
 
+# Compact interpolator format
+COMPACT_FORMAT = 'zapata-ocean-interpolator'
+COMPACT_VERSION = 2
+
+def from_compact(dirname, mmap_mode='r'):
+    '''
+    Read interpolator object written by `Ocean_Interpolator.to_compact`
+
+    The arrays are memory mapped with `mmap_mode`, the interpolator
+    can be used with `interp_T` and `interp_UV`.
+
+    Parameters
+    ==========
+    dirname:
+        Directory of the interpolator
+    mmap_mode:
+        Memory map mode for `numpy.load`, None reads the arrays in memory
+
+    Returns
+    =======
+    w:
+        Ocean_Interpolator
+    '''
+    with open(os.path.join(dirname, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('format') != COMPACT_FORMAT or meta.get('version') != COMPACT_VERSION:
+        raise ValueError(f'Unsupported interpolator format in {dirname} --> {meta.get("format")} {meta.get("version")}')
+
+    def load(k):
+        return np.load(os.path.join(dirname, k + '.npy'), mmap_mode=mmap_mode)
+
+    w = Ocean_Interpolator.__new__(Ocean_Interpolator)
+    for k in Ocean_Interpolator.__slots__:
+        setattr(w, k, None)
+    for k in ('name', 'ingrid', 'outgrid', 'level', 'window', 'period', 'cent_long'):
+        setattr(w, k, meta[k])
+    for k in ('sea_index', 'sea_index_reg', 'latlon', 'latlon_reg'):
+        setattr(w, k, load(k))
+    w.mask_reg = xr.DataArray(load('mask_reg'), dims=['lat', 'lon'], coords={'lat': load('lat'), 'lon': load('lon')})
+    for k, shape in meta['matrices'].items():
+        setattr(w, k, sparse.csr_matrix((load(k + '.data'), load(k + '.indices'), load(k + '.indptr')), shape=tuple(shape)))
+    return w
+
     
\ No newline at end of file
@@ -22,6 +22,7 @@ Modules
     - EDMD, kernel EDMD, generator EDMD
     - SINDy
     - kernel PCA, kernel CCA
+    - low-rank kernel methods with Nystroem or random Fourier features
     - CMD
     - SEBA
  
@@ -212,7 +213,7 @@ def gedmd(X, Y, Z, psi, evs=5, operator='K'):
     return (A, d, V)
 
 
-def kedmd(X, Y, k, epsilon=0, evs=5, operator='P',kind='kernel'):
+def kedmd(X, Y, k, epsilon=0, evs=5, operator='P',kind='kernel', approx=None, rank=100, seed=None):
     '''
     Kernel EDMD for the Koopman or Perron-Frobenius operator. The matrices X and Y
     contain the input data.
@@ -221,8 +222,17 @@ def kedmd(X, Y, k, epsilon=0, evs=5, operator='P',kind='kernel'):
     :param epsilon:  regularization parameter
     :param evs:      number of eigenvalues/eigenvectors
     :param operator: 'K' for Koopman or 'P' for Perron-Frobenius (note that the default is P here)
-    :return:         eigenvalues d and eigenfunctions evaluated in X
+    :param approx:   low-rank approximation of the Gram matrices, 'nystrom', 'rff' (random Fourier
+                     features) or a feature map of klus.kernels, None for the exact Gram matrices
+    :param rank:     rank of the approximation
+    :param seed:     seed for the landmarks or the random features
+    :return:         eigenvalues d and eigenfunctions evaluated in X, with `approx` the matrices A, G_0, G_1
+                     are returned as low-rank LinearOperator
     '''
+    if approx is not None:
+        PhiX, PhiY = _features(_kernels._points(X), _kernels._points(Y), k, approx, rank, seed)
+        return _lowrank_edmd(PhiX, PhiY, epsilon, evs, operator, kind, rcond=1e-15)
+
     if isinstance(X, list) or len(X.shape) < 2: # e.g., for strings
         n = len(X)
     else:
@@ -263,7 +273,7 @@ def sindy(X, Y, psi, eps=0.001, iterations=10):
     return Xi
 
 
-def kpca(X, k, evs=5):
+def kpca(X, k, evs=5, approx=None, rank=100, seed=None):
     '''
     Kernel PCA.
     
@@ -276,6 +286,12 @@ def kpca(X, k, evs=5):
        kernel
     param evs:  
      number of eigenvalues/eigenvectors
+    param approx:
+        low-rank approximation of the Gram matrix, 'nystrom', 'rff' or a feature map, see `kedmd`
+    param rank:
+        rank of the approximation
+    param seed:
+        seed for the landmarks or the random features
     
     Return
     ------
@@ -284,8 +300,14 @@ def kpca(X, k, evs=5):
     V:  
         data X projected onto principal components
     G:
-        Gram Matrix
+        Gram Matrix, a low-rank LinearOperator with `approx`
     '''
+    if approx is not None:
+        PhiX, _ = _features(_kernels._points(X), None, k, approx, rank, seed)
+        PhiX = PhiX - PhiX.mean(axis=0) # center features
+        d, V = _lowrank_eig(PhiX, PhiX, evs)
+        return (d, V, _lowrank(PhiX, PhiX))
+
     G = _kernels.gramian(X, k) # Gram matrix
     
     # center Gram matrix
@@ -296,7 +318,7 @@ def kpca(X, k, evs=5):
     return (d, V,G)
 
 
-def kcca(X, Y, k, option='CCA', evs=5, epsilon=1e-6):
+def kcca(X, Y, k, option='CCA', evs=5, epsilon=1e-6, approx=None, rank=100, seed=None):
     '''
     Kernel CCA. 
 
@@ -320,12 +342,22 @@ def kcca(X, Y, k, option='CCA', evs=5, epsilon=1e-6):
         number of eigenvalues/eigenvectors
     epsilon:
         regularization parameter
+    approx:
+        low-rank approximation of the Gram matrices, 'nystrom', 'rff' or a feature map, see `kedmd`.
+        Only the eigenvalues different from one are computed for the option 'CCA'
+    rank:
+        rank of the approximation
+    seed:
+        seed for the landmarks or the random features
 
     Returns
     -------
         CCA coefficients 
 
     '''
+    if approx is not None:
+        return _lowrank_kcca(X, Y, k, option, evs, epsilon, approx, rank, seed)
+
     G_0 = _kernels.gramian(X, k)
     G_1 = _kernels.gramian(Y, k)
     
@@ -445,7 +477,7 @@ def seba(V, R0=None, maxIter=5000):
         
     return S
 
-def kcovedmd(X, Y, k, epsilon=0, evs=5, operator='P'):
+def kcovedmd(X, Y, k, epsilon=0, evs=5, operator='P', approx=None, rank=100, seed=None):
     '''
     Kernel Covariance EDMD for the Koopman or Perron-Frobenius operator. 
     The matrices X and Y contain the input data.
@@ -454,8 +486,15 @@ def kcovedmd(X, Y, k, epsilon=0, evs=5, operator='P'):
     :param epsilon:  regularization parameter
     :param evs:      number of eigenvalues/eigenvectors
     :param operator: 'K' for Koopman or 'P' for Perron-Frobenius (note that the default is P here)
+    :param approx:   low-rank approximation, 'nystrom', 'rff' or a feature map, see `kedmd`
+    :param rank:     rank of the approximation
+    :param seed:     seed for the landmarks or the random features
     :return:         eigenvalues d and eigenfunctions evaluated in X
     '''
+    if approx is not None:
+        PhiX, PhiY = _features(X, Y, k, approx, rank, seed)
+        return _lowrank_edmd(PhiX, PhiY, epsilon, evs, operator, 'kernel', rcond=1e-10)
+
     if isinstance(X, list): # e.g., for strings
         n = len(X)
     else:
@@ -496,3 +535,124 @@ def FeatureMatrix(x,z,k):
     K = _kernels.gramian2(x, z, k)
     
     return K
+
+# low-rank kernel approximations
+def _features(X, Y, k, approx, rank, seed):
+    '''
+    Low-rank features of the data points X and Y (rows), k(x, y) ~ phi(x)^T phi(y).
+    '''
+    if approx == 'nystrom':
+        fmap = _kernels.nystromFeatures(k, rank, seed=seed)
+    elif approx == 'rff':
+        fmap = _kernels.randomFourierFeatures(k, rank, seed=seed)
+    elif isinstance(approx, str):
+        raise ValueError('Low-rank approximation not available: %s.' % approx)
+    else:
+        fmap = approx
+    fmap.fit(X)
+    return fmap(X), (None if Y is None else fmap(Y))
+
+def _lowrank(L, R, shift=0.):
+    '''
+    Matrix shift*I + L @ R.T as a LinearOperator.
+    '''
+    def matmat(Z):
+        return shift*Z + L @ (R.T @ Z)
+    def rmatmat(Z):
+        return shift*Z + R @ (L.T.conj() @ Z)
+    return _sp.sparse.linalg.LinearOperator((L.shape[0], R.shape[0]), matvec=matmat, rmatvec=rmatmat,
+                                            matmat=matmat, rmatmat=rmatmat, dtype=_np.result_type(L, R))
+
+def _lowrank_solve(Phi, epsilon, Z, rcond):
+    '''
+    pinv(Phi @ Phi.T + epsilon*I) @ Z with the thin SVD of the features Phi.
+    '''
+    Q, s, _ = _sp.linalg.svd(Phi, full_matrices=False)
+    lam = s**2 + epsilon
+    cut = rcond * lam.max()
+    keep = lam > cut
+    QZ = Q.T @ Z
+    out = Q[:, keep] @ (QZ[keep] / lam[keep][:, None])
+    if epsilon > cut:
+        out += (Z - Q @ QZ) / epsilon
+    return out
+
+def _lowrank_eig(L, R, evs=5, shift=0.):
+    '''
+    Eigenvalues and eigenvectors of shift*I + L @ R.T different from shift, sorted as in sortEig.
+    '''
+    mu, W = _np.linalg.eig(R.T @ L)
+    d = shift + mu
+    V = L @ W
+    norm = _np.linalg.norm(V, axis=0)
+    V = V / _np.where(norm > 0, norm, 1)
+    ind = _np.argsort(-_np.abs(d))[:evs]
+    d, V = d[ind], V[:, ind]
+    ind = d.argsort()[::-1]
+    return (d[ind], V[:, ind])
+
+def _lowrank_edmd(PhiX, PhiY, epsilon, evs, operator, kind, rcond):
+    '''
+    Kernel EDMD with the low-rank Gram matrices G_0 = PhiX PhiX^T and G_1 = PhiX PhiY^T.
+    '''
+    G_0 = _lowrank(PhiX, PhiX)
+    if operator == 'K':
+        P, Q = PhiY, PhiX
+    else:
+        P, Q = PhiX, PhiY
+    G_1 = _lowrank(P, Q)
+    if kind == 'kernel':
+        L, R = _lowrank_solve(PhiX, epsilon, P, rcond), Q
+    elif kind == 'embedded':
+        L, R = P, _lowrank_solve(PhiX, epsilon, Q, rcond)
+    else:
+        raise ValueError('Error in KEDMD, kind %s.' % kind)
+    d, V = _lowrank_eig(L, R, evs)
+    if operator == 'K': V = G_0 @ V
+    return (d, V, _lowrank(L, R), G_0, G_1)
+
+def _lowrank_kcca(X, Y, k, option, evs, epsilon, approx, rank, seed):
+    '''
+    Kernel CCA with low-rank centered Gram matrices.
+    '''
+    Phi0, _ = _features(_kernels._points(X), None, k, approx, rank, seed)
+    Phi1, _ = _features(_kernels._points(Y), None, k, approx, rank, seed)
+    Phi0 = Phi0 - Phi0.mean(axis=0)
+    Phi1 = Phi1 - Phi1.mean(axis=0)
+    n = Phi0.shape[0]
+
+    if option == 'lagged':
+        print(' Computing low-rank kernel CCA with lagged data  \n')
+        M0 = _lowrank_solve(Phi0, epsilon, Phi0, 1e-15)
+        M1 = _lowrank_solve(Phi1, epsilon, Phi1, 1e-15)
+        L, R = M0, Phi1 @ (M1.T @ Phi0)
+        d, V = _lowrank_eig(L, R, evs)
+        A = _lowrank(L, R)
+
+    elif option == 'CCA':
+        print(' Computing low-rank KCCA  \n')
+        if epsilon <= 0:
+            raise ValueError('Low-rank KCCA requires epsilon > 0.')
+        # (G_0 + eps I)^-1 (G_1 + eps I) = I + (G_0 + eps I)^-1 (G_1 - G_0) and vice versa
+        R0 = _np.hstack((Phi1, Phi0))
+        L0 = _lowrank_solve(Phi0, epsilon, _np.hstack((Phi1, -Phi0)), 1e-15)
+        R1 = _np.hstack((Phi0, Phi1))
+        L1 = _lowrank_solve(Phi1, epsilon, _np.hstack((Phi0, -Phi1)), 1e-15)
+        d0, V0 = _lowrank_eig(L0, R0, R0.shape[1], shift=1.)
+        d1, V1 = _lowrank_eig(L1, R1, R1.shape[1], shift=1.)
+        d = _np.concatenate((d0, d1))
+        V = _np.zeros((2*n, d.size), dtype=_np.result_type(V0, V1))
+        V[:n, :d0.size] = V0
+        V[n:, d0.size:] = V1
+        ind = _np.argsort(-_np.abs(d))[:evs]
+        d, V = d[ind], V[:, ind]
+        ind = d.argsort()[::-1]
+        d, V = d[ind], V[:, ind]
+        A0 = _lowrank(L0, R0, shift=1.)
+        A1 = _lowrank(L1, R1, shift=1.)
+        def matmat(Z):
+            return _np.concatenate((A0 @ Z[:n], A1 @ Z[n:]))
+        A = _sp.sparse.linalg.LinearOperator((2*n, 2*n), matvec=matmat, matmat=matmat, dtype=A0.dtype)
+    else:
+        raise ValueError('Error in KCCA, option %s.' % option)
+    return (A, d, V)
@@ -1,14 +1,55 @@
 import numpy as _np
-from scipy.spatial import distance
+from scipy.signal import lfilter
+from concurrent.futures import ProcessPoolExecutor
 '''
 Definitions of nonlinear kernels
 
 * gaussian
 * polynomial
 * laplacian
+* string
+
+Low-rank feature maps, k(x, y) ~ phi(x)^T phi(y)
+
+* nystromFeatures
+* randomFourierFeatures
+
+The kernels derive from `Kernel` and evaluate whole kernel matrices with
+`pairwise(X, Y)`, where the rows of `X` and `Y` are the data points. User-defined
+kernels only need `__call__(x, y)`, their kernel matrices are evaluated in blocks
+by broadcasting if `__call__` supports it (see `Kernel.pairwise`), pair by pair otherwise.
+
+Large kernel matrices are computed by `gram` in tiles bounded by `GRAM_BYTES`, that can be written
+in a preallocated or memory-mapped array. For the Gaussian and Laplacian kernels the squared
+distances of each tile are obtained with a matrix product (BLAS) as
+:math:`\|x\|^2 + \|y\|^2 - 2 x^T y` and the exponential is applied in place.
 '''
 
-class gaussianKernel(object):
+# Memory (bytes) of the tiles of `gram`
+GRAM_BYTES = 2**27
+
+class Kernel(object):
+    '''
+    Base class of the kernels.
+
+    Derived classes define `__call__(x, y)` for a pair of points and may override
+    `pairwise(X, Y)` for the kernel matrix. The default `pairwise` calls the kernel
+    on blocks of rows of `X` broadcast against `Y`, ``k(X[i:j, None, :], Y[None, :, :])``,
+    if the kernel reduces over the last axis, e.g. using ``sum(..., axis=-1)``. 
+    Otherwise it is evaluated pair by pair.
+    '''
+    # Memory (bytes) of the broadcast blocks
+    block_bytes = 2**27
+
+    def __call__(self, x, y):
+        raise NotImplementedError('Kernel must define __call__(x, y)')
+
+    def pairwise(self, X, Y=None):
+        '''Kernel matrix between the rows of X and Y, Y=None for the Gram matrix of X.'''
+        return _pairwise_fallback(self, X, Y)
+
+
+class gaussianKernel(Kernel):
     '''Gaussian kernel with bandwidth sigma.'''
     def __init__(self, sigma):
         self.sigma = sigma
@@ -17,20 +58,34 @@ class gaussianKernel(object):
         return _np.exp(-_np.linalg.norm(x-y)**2/(2*self.sigma**2))
     def __repr__(self):
         return 'Gaussian kernel with bandwidth sigma = %f.' % self.sigma
+    def pairwise(self, X, Y=None):
+        return gram(self, X, Y)
+    def _from_sqdist(self, D):
+        '''Kernel from the squared distances D, in place.'''
+        D *= -1/(2*self.sigma**2)
+        return _np.exp(D, out=D)
     
 
 
-class laplacianKernel(object):
+class laplacianKernel(Kernel):
     '''Laplacian kernel with bandwidth sigma.'''
     def __init__(self, sigma):
         self.sigma = sigma
+        self.name  ='Laplacian'
     def __call__(self, x, y):
         return _np.exp(-_np.linalg.norm(x-y)/self.sigma)
     def __repr__(self):
         return 'Laplacian kernel with bandwidth sigma = %f.' % self.sigma
+    def pairwise(self, X, Y=None):
+        return gram(self, X, Y)
+    def _from_sqdist(self, D):
+        '''Kernel from the squared distances D, in place.'''
+        _np.sqrt(D, out=D)
+        D *= -1/self.sigma
+        return _np.exp(D, out=D)
 
 
-class polynomialKernel(object):
+class polynomialKernel(Kernel):
     '''Polynomial kernel with degree p and inhomogeneity c.'''
     def __init__(self, p, c=1):
         self.p = p
@@ -40,221 +95,344 @@ class polynomialKernel(object):
         return (self.c + x@y)**self.p
     def __repr__(self):
         return 'Polynomial kernel with degree p = %f and inhomogeneity c = %f.' % (self.p, self.c)
+    def pairwise(self, X, Y=None):
+        X = _np.asarray(X)
+        Y = X if Y is None else _np.asarray(Y)
+        return (self.c + X @ Y.T)**self.p
 
 
-class stringKernel(object):
+class stringKernel(Kernel):
     '''
     String kernel implementation based on Marianna Madry's C++ code, see
     https://github.com/mmadry/string_kernel.
+
+    The dynamic program is evaluated a whole matrix at a time for each subsequence length,
+    the self-evaluations used for the normalization are cached and the kernel matrices
+    are computed by a process pool with `workers` processes, if given.
     '''
-    def __init__(self, kn = 2, l = 0.9):
+    def __init__(self, kn = 2, l = 0.9, workers=None):
         self._kn = kn # level of subsequence matching
         self._l  = l  # decay factor
+        self.workers = workers # processes for the kernel matrices
+        self._diag = {} # cache of the self-evaluations
 
     def __call__(self, x, y):
-        return self.evaluate(x, y) / _np.sqrt(self.evaluate(x, x)*self.evaluate(y, y))
+        return self.evaluate(x, y) / _np.sqrt(self.diag([x])[0]*self.diag([y])[0])
 
     def __repr__(self):
         return 'String kernel.'
 
-    def evaluate(self, x, y):
-        '''Unnormalized string kernel evaluation.'''
-        lx = len(x)
-        ly = len(y)
-        Kd = _np.zeros([2, lx+1, ly+1])
-
-        # dynamic programming
-        for i in range(2):
-            Kd[i, :, :] = (i + 1) % 2
-
-        # calculate Kd and Kdd
-        for i in range(1, self._kn):
-            # set the Kd to zero for those lengths of s and t where s (or t) has exactly length i-1 and t (or s)
-            # has length >= i-1. L-shaped upside down matrix
-            for j in range(i - 1,  lx):
-                Kd[i % 2, j, i - 1] = 0
-            for j in range(i - 1, ly):
-                Kd[i % 2, i - 1, j] = 0
-            for j in range(i, lx):
-                Kdd = 0
-                for m in range(i, ly):
-                    if x[j - 1] != y[m - 1]:
-                        Kdd = self._l * Kdd
-                    else:
-                        Kdd = self._l * (Kdd + self._l * Kd[(i + 1) % 2, j - 1, m - 1])
-                    Kd[i % 2, j, m] = self._l * Kd[i % 2, j - 1, m] + Kdd
-
-        # calculate value of kernel function evaluation
-        s = 0
-        for i in range(self._kn, len(x) + 1):
-            for j in range(self._kn, len(y)+1):
-                if x[i - 1] == y[j - 1]:
-                    s += self._l**2 * Kd[(self._kn - 1) % 2, i - 1, j - 1]
-
-        return s
-
-
-def gramian(X, k):
-    '''Compute Gram matrix for training data X with kernel k.'''
-    name = k.__class__.__name__
-    if name == 'gaussianKernel':
-        return _np.exp(-distance.squareform(distance.pdist(X.T, 'sqeuclidean'))/(2*k.sigma**2))
-    elif name == 'laplacianKernel':
-        return _np.exp(-distance.squareform(distance.pdist(X.T, 'euclidean'))/k.sigma)
-    elif name == 'polynomialKernel':
-        return (k.c + X.T @ X)**k.p
-    elif name == 'stringKernel':
-        n = len(X)
-        # compute weights for normalization
-        d = _np.zeros(n)
-        for i in range(n):
-            d[i] = k.evaluate(X[i], X[i])
-        # compute Gram matrix
-        G = _np.ones([n, n]) # diagonal automatically set to 1
-        for i in range(n):
-            for j in range(i):
-                G[i, j] = k.evaluate(X[i], X[j]) / _np.sqrt(d[i]*d[j])
-                G[j, i] = G[i, j]
-        return G
-    else:
-        #print('User-defined kernel.')
-        if isinstance(X, list): # e.g., for strings
-            n = len(X)
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(i+1):
-                    
-                    G[i, j] = k(X[i], X[j])
-                    G[j, i] = G[i, j]
+    def diag(self, X):
+        '''Unnormalized self-evaluations of the strings X, cached.'''
+        out = _np.zeros(len(X))
+        for i, x in enumerate(X):
+            key = _string_key(x)
+            if key not in self._diag:
+                self._diag[key] = self.evaluate(x, x)
+            out[i] = self._diag[key]
+        return out
+
+    def pairwise(self, X, Y=None):
+        '''Normalized kernel matrix, the self-evaluations are computed once for each string.'''
+        symmetric = Y is None
+        if symmetric:
+            Y = X
+        m, n = len(X), len(Y)
+        if self.workers:
+            data = (self._kn, self._l, X, Y)
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_string_init, initargs=(data,)) as pool:
+                # self-evaluations not yet in the cache
+                new = {_string_key(x): x for x in list(X) + list(Y) if _string_key(x) not in self._diag}
+                values = pool.map(_string_evaluate, new.values(), new.values(), [self._kn]*len(new), [self._l]*len(new))
+                self._diag.update(zip(new.keys(), values))
+                ntask = 4*self.workers
+                rows = [range(t, m, ntask) for t in range(ntask)]
+                blocks = list(pool.map(_string_rows, rows, [symmetric]*ntask))
         else:
-            n = X.shape[1]
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(i+1):
-                    G[i, j] = k(X[:, i], X[:, j])
-                    G[j, i] = G[i, j]
+            rows = [range(m)]
+            blocks = [_string_rows(rows[0], symmetric, (self._kn, self._l, X, Y))]
+        dx = self.diag(X)
+        dy = dx if symmetric else self.diag(Y)
+
+        G = _np.zeros([m, n])
+        for r, E in zip(rows, blocks):
+            for i, e in zip(r, E):
+                G[i, :len(e)] = e
+        G /= _np.sqrt(dx[:, None]*dy[None, :])
+        if symmetric:
+            G += G.T
+            _np.fill_diagonal(G, 1) # diagonal automatically set to 1
         return G
 
+    def evaluate(self, x, y):
+        '''Unnormalized string kernel evaluation.'''
+        return _string_evaluate(x, y, self._kn, self._l)
 
-def gramian2(X, Y, k):
-    '''Compute Gram matrix for training data X and Y with kernel k.'''
-    name = k.__class__.__name__
-    if name == 'gaussianKernel':
-        #print('Gaussian kernel with sigma = %f.' % k.sigma)
-        return _np.exp(-distance.cdist(X.T, Y.T, 'sqeuclidean')/(2*k.sigma**2))
-    elif name == 'laplacianKernel':
-        #print('Laplacian kernel with sigma = %f.' % k.sigma)
-        return _np.exp(-distance.cdist(X.T, Y.T, 'euclidean')/k.sigma)
-    elif name == 'polynomialKernel':
-        #print('Polynomial kernel with degree = %f and c = %f.' % (k.p, k.c))
-        return (k.c + X.T@Y)**k.p
-    elif name == 'stringKernel':
-        n = len(X)
-        d = _np.zeros([n, 2])
-        for i in range(n):
-            d[i, 0] = k.evaluate(X[i], X[i])
-            d[i, 1] = k.evaluate(Y[i], Y[i])
-        # compute Gram matrix
-        G = _np.zeros([n, n])
-        for i in range(n):
-            for j in range(n):
-                G[i, j] = k.evaluate(X[i], Y[j]) / _np.sqrt(d[i, 0]*d[j, 1])
-        return G
-    else:
-        #print('User-defined kernel.')
-        if isinstance(X, list): # e.g., for strings
-            n = len(X)
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(n):
-                    G[i, j] = k(X[i], Y[j])
-        else:
-            n = X.shape[1]
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(n):
-                    G[i, j] = k(X[:, i], Y[:, j])
+
+def _string_evaluate(x, y, kn, l):
+    '''
+    Unnormalized string kernel of x and y with subsequence length kn and decay l.
+
+    For each length i the recurrences Kdd[j, m] = l*Kdd[j, m-1] + l^2*[x_j == y_m]*Kd_{i-1}[j-1, m-1]
+    and Kd_i[j, m] = l*Kd_i[j-1, m] + Kdd[j, m] are evaluated along whole rows and columns
+    as linear filters.
+    '''
+    lx = len(x)
+    ly = len(y)
+    if lx == 0 or ly == 0:
+        return 0.
+    match = _np.equal.outer(_np.array(list(x)), _np.array(list(y)))
+    Kd = _np.ones([lx+1, ly+1])
+
+    for i in range(1, kn):
+        # Kd is zero where s (or t) has length i-1
+        K = _np.zeros([lx+1, ly+1])
+        if i < lx and i < ly:
+            a = l**2 * match[i-1:lx-1, i-1:ly-1] * Kd[i-1:lx-1, i-1:ly-1]
+            Kdd = lfilter([1.], [1., -l], a, axis=1)
+            K[i:lx, i:ly] = lfilter([1.], [1., -l], Kdd, axis=0)
+        Kd = K
+
+    # calculate value of kernel function evaluation
+    return l**2 * _np.sum(match[kn-1:, kn-1:] * Kd[kn-1:lx, kn-1:ly])
+
+def _string_key(x):
+    '''Hashable key of the sequence x.'''
+    return x if isinstance(x, str) else tuple(x)
+
+# Data of the string kernel worker processes
+_STRING_DATA = None
+
+def _string_init(data):
+    '''Store kn, l and the strings in the worker process.'''
+    global _STRING_DATA
+    _STRING_DATA = data
+
+def _string_rows(rows, symmetric, data=None):
+    '''Unnormalized kernel of the strings X[rows] with Y, only with Y[:i] for the row i if symmetric.'''
+    kn, l, X, Y = _STRING_DATA if data is None else data
+    return [_np.array([_string_evaluate(X[i], Y[j], kn, l) for j in range(i if symmetric else len(Y))]) for i in rows]
+
+
+def pairwise(k, X, Y=None):
+    '''
+    Kernel matrix of kernel k between the rows of X and Y (Y=None for X with itself).
+
+    Kernels without a `pairwise` method are evaluated with the fallback of `Kernel.pairwise`.
+    '''
+    if hasattr(k, 'pairwise'):
+        return k.pairwise(X, Y)
+    return _pairwise_fallback(k, X, Y)
+
+def _points(X):
+    '''Data points of the data matrix X stored by columns, lists (e.g., strings) are unchanged.'''
+    if isinstance(X, _np.ndarray) and X.ndim == 2:
+        return X.T
+    return X
+
+def gram(k, X, Y=None, out=None, max_bytes=None, mirror=True):
+    '''
+    Kernel matrix of kernel k between the rows of X and Y, computed in tiles.
+
+    The tiles have at most `max_bytes` bytes. For kernels of the distance (Gaussian, Laplacian)
+    the squared distances of a tile are computed with one matrix product, the other kernels
+    are evaluated with `pairwise` on each tile. For the Gram matrix (Y=None) only the tiles
+    of the lower triangle are computed.
+
+    :param out:       preallocated (n, m) array, e.g. a `numpy.memmap`, or the name of a `.npy` file
+                      to be created and memory mapped
+    :param max_bytes: memory of the tiles, default `GRAM_BYTES`
+    :param mirror:    copy the lower triangle in the upper one for the Gram matrix, if False the
+                      upper triangle is not written
+    :return:          kernel matrix (`out` if given)
+    '''
+    symmetric = Y is None
+    X = _np.asarray(X)
+    Y = X if symmetric else _np.asarray(Y)
+    m, n = len(X), len(Y)
+    if out is None:
+        out = _np.empty([m, n])
+    elif isinstance(out, str):
+        out = _np.lib.format.open_memmap(out, mode='w+', dtype=float, shape=(m, n))
+    if out.shape != (m, n):
+        raise ValueError('Output of shape %s, expected %s.' % (out.shape, (m, n)))
+    b = max(1, int(_np.sqrt((GRAM_BYTES if max_bytes is None else max_bytes) / out.itemsize)))
+
+    blas = hasattr(k, '_from_sqdist')
+    if blas:
+        nx = _np.einsum('ij,ij->i', X, X)
+        ny = nx if symmetric else _np.einsum('ij,ij->i', Y, Y)
+
+    for i in range(0, m, b):
+        for j in range(0, i + 1 if symmetric else n, b):
+            T = out[i:i+b, j:j+b]
+            if blas:
+                _np.matmul(X[i:i+b], Y[j:j+b].T, out=T)
+                T *= -2
+                T += nx[i:i+b, None]
+                T += ny[None, j:j+b]
+                _np.maximum(T, 0, out=T)
+                if symmetric and i == j:
+                    _np.fill_diagonal(T, 0)
+                k._from_sqdist(T)
+            else:
+                T[...] = pairwise(k, X[i:i+b], Y[j:j+b])
+            if symmetric and mirror and j < i:
+                out[j:j+b, i:i+b] = T.T
+    return out
+
+def _broadcasts(k, X, Y):
+    '''Check on a few points whether k can be broadcast over blocks of points.'''
+    m = min(len(X), 3)
+    n = min(len(Y), 3)
+    try:
+        with _np.errstate(all='ignore'):
+            G = _np.asarray(k(X[:m, None, :], Y[None, :n, :]), dtype=float)
+    except Exception:
+        return False
+    if G.shape != (m, n):
+        return False
+    ref = _np.array([[k(X[i], Y[j]) for j in range(n)] for i in range(m)], dtype=float)
+    return _np.allclose(G, ref, equal_nan=True)
+
+def _pairwise_fallback(k, X, Y=None):
+    '''Kernel matrix of a user-defined kernel, by broadcast blocks or pair by pair.'''
+    symmetric = Y is None
+    if symmetric:
+        Y = X
+    if isinstance(X, _np.ndarray) and X.ndim == 2 and _broadcasts(k, X, Y):
+        m, n = len(X), len(Y)
+        step = max(1, int(getattr(k, 'block_bytes', Kernel.block_bytes) // (8 * n * X.shape[1])))
+        G = _np.empty([m, n])
+        for i in range(0, m, step):
+            G[i:i+step] = k(X[i:i+step, None, :], Y[None, :, :])
         return G
 
+    m, n = len(X), len(Y)
+    G = _np.zeros([m, n])
+    for i in range(m):
+        for j in range(i+1 if symmetric else n):
+            G[i, j] = k(X[i], Y[j])
+            if symmetric:
+                G[j, i] = G[i, j]
+    return G
+
+
+def gramian(X, k, out=None):
+    '''Compute Gram matrix for training data X with kernel k, optionally in `out` (see `gram`).'''
+    if out is not None:
+        return gram(k, _points(X), out=out)
+    return pairwise(k, _points(X))
+
+
+def gramian2(X, Y, k, out=None):
+    '''Compute Gram matrix for training data X and Y with kernel k, optionally in `out` (see `gram`).'''
+    if out is not None:
+        return gram(k, _points(X), _points(Y), out=out)
+    return pairwise(k, _points(X), _points(Y))
+
 def covariance(X, k):
     '''Compute Covariance matrix for training data X with kernel k.'''
-    name = k.__class__.__name__
-    if name == 'gaussianKernel':
-        return _np.exp(-distance.squareform(distance.pdist(X, 'sqeuclidean'))/(2*k.sigma**2))
-    elif name == 'laplacianKernel':
-        return _np.exp(-distance.squareform(distance.pdist(X, 'euclidean'))/k.sigma)
-    elif name == 'polynomialKernel':
-        return (k.c + X @ X.T)**k.p
-    elif name == 'stringKernel':
-        n = len(X)
-        # compute weights for normalization
-        d = _np.zeros(n)
-        for i in range(n):
-            d[i] = k.evaluate(X[i], X[i])
-        # compute Gram matrix
-        G = _np.ones([n, n]) # diagonal automatically set to 1
-        for i in range(n):
-            for j in range(i):
-                G[i, j] = k.evaluate(X[i], X[j]) / _np.sqrt(d[i]*d[j])
-                G[j, i] = G[i, j]
-        return G
-    else:
-        #print('User-defined kernel.')
-        if isinstance(X, list): # e.g., for strings
-            n = len(X)
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(i+1):
-                    
-                    G[i, j] = k(X[i], X[j])
-                    G[j, i] = G[i, j]
-        else:
-            n = X.shape[1]
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(i+1):
-                    G[i, j] = k(X[i,:], X[j,:])
-                    G[j, i] = G[i, j]
-        return G
+    return pairwise(k, X)
+
 def crosscov(X, Y, k):
     '''Compute crosscovariance matrix for training data X and Y with kernel k.'''
-    name = k.__class__.__name__
-    if name == 'gaussianKernel':
-        #print('Gaussian kernel with sigma = %f.' % k.sigma)
-        return _np.exp(-distance.cdist(X, Y, 'sqeuclidean')/(2*k.sigma**2))
-    elif name == 'laplacianKernel':
-        #print('Laplacian kernel with sigma = %f.' % k.sigma)
-        return _np.exp(-distance.cdist(X, Y, 'euclidean')/k.sigma)
-    elif name == 'polynomialKernel':
-        #print('Polynomial kernel with degree = %f and c = %f.' % (k.p, k.c))
-        return (k.c + X@Y.T)**k.p
-    elif name == 'stringKernel':
+    return pairwise(k, X, Y)
+
+class nystromFeatures(object):
+    '''
+    Nystroem feature map of kernel k with rank landmarks, k(x, y) ~ phi(x)^T phi(y).
+
+    The landmarks are selected among the data points by pivoted incomplete Cholesky
+    factorization of the Gram matrix ('greedy') or uniformly at random ('random').
+    '''
+    def __init__(self, k, rank, landmarks='greedy', seed=None, rcond=1e-10):
+        self.k = k
+        self.rank = rank
+        self.landmarks = landmarks
+        self.seed = seed
+        self.rcond = rcond
+    def __repr__(self):
+        return 'Nystroem features of rank %d with %s landmarks.' % (self.rank, self.landmarks)
+    def fit(self, X):
+        '''Select the landmarks among the rows of X.'''
         n = len(X)
-        d = _np.zeros([n, 2])
-        for i in range(n):
-            d[i, 0] = k.evaluate(X[i], X[i])
-            d[i, 1] = k.evaluate(Y[i], Y[i])
-        # compute Gram matrix
-        G = _np.zeros([n, n])
-        for i in range(n):
-            for j in range(n):
-                G[i, j] = k.evaluate(X[i], Y[j]) / _np.sqrt(d[i, 0]*d[j, 1])
-        return G
-    else:
-        #print('User-defined kernel.')
-        if isinstance(X, list): # e.g., for strings
-            n = len(X)
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(n):
-                    G[i, j] = k(X[i], Y[j])
+        r = min(self.rank, n)
+        if self.landmarks == 'greedy':
+            index = _pivoted_cholesky(self.k, X, r, self.rcond)
+        elif self.landmarks == 'random':
+            index = _np.random.default_rng(self.seed).choice(n, r, replace=False)
         else:
-            n = X.shape[1]
-            G = _np.zeros([n, n])
-            for i in range(n):
-                for j in range(n):
-                    G[i, j] = k(X[i,:], Y[j,:])
-        return G
+            raise ValueError('Landmarks selection not available: %s.' % self.landmarks)
+        self.index = _np.sort(index)
+        self.L = _take(X, self.index)
+        d, U = _np.linalg.eigh(pairwise(self.k, self.L))
+        keep = d > self.rcond * d.max()
+        self.W = U[:, keep] / _np.sqrt(d[keep])
+        return self
+    def __call__(self, X):
+        '''Features of the rows of X.'''
+        return pairwise(self.k, X, self.L) @ self.W
+
+
+class randomFourierFeatures(object):
+    '''
+    Random Fourier features of the Gaussian and Laplacian kernels, k(x, y) ~ phi(x)^T phi(y),
+    with phi(x) = sqrt(2/rank) cos(W^T x + b).
+    '''
+    def __init__(self, k, rank, seed=None):
+        if not isinstance(k, (gaussianKernel, laplacianKernel)):
+            raise ValueError('Random Fourier features only for Gaussian and Laplacian kernels.')
+        self.k = k
+        self.rank = rank
+        self.seed = seed
+    def __repr__(self):
+        return 'Random Fourier features of rank %d.' % self.rank
+    def fit(self, X):
+        '''Draw the frequencies for the dimension of the rows of X.'''
+        rng = _np.random.default_rng(self.seed)
+        d = _np.shape(X)[1]
+        W = rng.standard_normal((d, self.rank)) / self.k.sigma
+        if isinstance(self.k, laplacianKernel):
+            # multivariate Cauchy distribution
+            W /= _np.abs(rng.standard_normal(self.rank))
+        self.W = W
+        self.b = rng.uniform(0, 2*_np.pi, self.rank)
+        return self
+    def __call__(self, X):
+        '''Features of the rows of X.'''
+        Z = _np.asarray(X) @ self.W
+        Z += self.b
+        _np.cos(Z, out=Z)
+        Z *= _np.sqrt(2/self.rank)
+        return Z
+
+
+def _take(X, index):
+    '''Rows index of X, also for lists.'''
+    if isinstance(X, _np.ndarray):
+        return X[index]
+    return [X[i] for i in index]
+
+def _pivoted_cholesky(k, X, r, tol=1e-10):
+    '''Pivots of the incomplete Cholesky factorization of rank r of the Gram matrix of X.'''
+    n = len(X)
+    if hasattr(k, '_from_sqdist'):
+        d = _np.ones(n)
+    else:
+        d = _np.array([pairwise(k, _take(X, [i]))[0, 0] for i in range(n)], dtype=float)
+    dmax = d.max()
+    F = _np.zeros([n, r])
+    index = []
+    for j in range(r):
+        p = int(_np.argmax(d))
+        if d[p] <= tol * dmax:
+            break
+        index.append(p)
+        F[:, j] = (pairwise(k, X, _take(X, [p]))[:, 0] - F[:, :j] @ F[p, :j]) / _np.sqrt(d[p])
+        d -= F[:, j]**2
+        d[index] = 0
+    return _np.array(index)
 
 class Eigenfunction():
     def __init__(self, k, X, v):
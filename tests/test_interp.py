@@ -0,0 +1,95 @@
+import numpy as np
+import xarray as xr
+
+import interp as zint
+
+NY, NX = 30, 74
+
+
+def orca_f_points(ny=NY, nx=NX):
+    '''F points of a curvilinear grid with the two columns of the ORCA halo'''
+    j, i = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+    lon = (i - 1) * 360. / (nx - 2) + 2. * np.sin(2 * np.pi * j / ny)
+    lat = -60. + j * 120. / (ny - 1)
+    lon[:, 0], lon[:, -1] = lon[:, -2], lon[:, 1]
+    return lat, lon % 360.
+
+
+def cell_areas(corners):
+    '''Areas of the cells in the (lon, sin(lat)) plane used by `conservative_weights`'''
+    lon = corners[..., 1]
+    x = np.deg2rad(lon[:, :1] + (lon - lon[:, :1] + 180.) % 360. - 180.)
+    y = np.sin(np.deg2rad(corners[..., 0]))
+    return 0.5 * np.abs((x * np.roll(y, -1, 1) - np.roll(x, -1, 1) * y).sum(axis=1))
+
+
+def test_conservative_halo_integral():
+    latF, lonF = orca_f_points()
+    corners = zint.nemo_corners(latF, lonF)
+    assert np.isnan(corners.reshape(NY, NX, 4, 2)[:, [0, NX - 1]]).all()
+
+    lat_edges, lon_edges = zint.regular_edges(np.arange(-59., 60., 2.), np.arange(0., 360., 3.))
+    assert lat_edges[0] == -60. and lat_edges[-1] == 60.
+    W = zint.conservative_weights(corners, lat_edges, lon_edges)
+
+    T = np.random.default_rng(0).normal(size=NY * NX)
+    good = np.isfinite(corners).all(axis=(1, 2))
+    src = (T * cell_areas(corners))[good].sum()
+    ya = np.sin(np.deg2rad(lat_edges))
+    tgt_area = (np.diff(ya)[:, None] * np.deg2rad(np.diff(lon_edges))[None, :]).ravel()
+    np.testing.assert_allclose((W @ T * tgt_area).sum(), src, rtol=1e-10)
+    np.testing.assert_allclose(cell_areas(corners)[good].sum(), tgt_area.sum(), rtol=1e-10)
+
+
+def src_struct(ny=40, nx=90):
+    j, i = np.meshgrid(np.arange(ny), np.arange(nx), indexing='ij')
+
+    def coords(dj, di):
+        lon = (i + di) * 360. / nx + 3. * np.sin(2 * np.pi * (j + dj) / ny)
+        lat = -75. + (j + dj) * 150. / (ny - 1) + 2. * np.cos(2 * np.pi * (i + di) / nx)
+        return xr.DataArray(lon % 360, dims=('y', 'x')), xr.DataArray(lat, dims=('y', 'x'))
+
+    land = np.zeros((ny, nx), bool)
+    land[10:18, 20:35] = True
+    land[25:30, 60:80] = True
+    land[:3] = True
+    extra = {c: xr.DataArray(np.zeros((ny, nx)), dims=('y', 'x')) for c in ['U_lon', 'U_lat', 'V_lon', 'V_lat', 'T_lon', 'T_lat']}
+
+    def mask(l):
+        return xr.DataArray((~l).astype(float), dims=('y', 'x'), coords=dict(extra, z=1))
+
+    lonT, latT = coords(0, 0)
+    lonU, latU = coords(0, .5)
+    lonV, latV = coords(.5, 0)
+    lonF, latF = coords(.5, .5)
+    tangle = xr.DataArray(10. * np.sin(2 * np.pi * j / ny) * np.cos(2 * np.pi * i / nx), dims=('y', 'x'))
+    return {'tmask': mask(land), 'umask': mask(land | np.roll(land, -1, 1)), 'vmask': mask(land | np.roll(land, -1, 0)),
+            'tangle': tangle, 'lonT': lonT, 'latT': latT, 'lonU': lonU, 'latU': latU,
+            'lonV': lonV, 'latV': latV, 'lonF': lonF, 'latF': latF}
+
+
+def tgt_struct():
+    lat = np.arange(-70, 71, 2.)
+    lon = np.arange(0, 360, 2.)
+    return {'tmask': xr.DataArray(np.ones((lat.size, lon.size)), dims=('lat', 'lon'), coords={'lat': lat, 'lon': lon}),
+            'tangle': None, 'cent_long': 180}
+
+
+def test_fill_sea_over_land_matches_fused_operator():
+    s_in = src_struct()
+    w = zint.Ocean_Interpolator('SRC', 'TGT', s_in=s_in, s_out=tgt_struct())
+    rng = np.random.default_rng(1)
+    U = xr.DataArray(np.where(s_in['umask'] != 0, rng.normal(size=s_in['umask'].shape), np.nan), dims=('y', 'x'))
+    V = xr.DataArray(np.where(s_in['vmask'] != 0, rng.normal(size=s_in['vmask'].shape), np.nan), dims=('y', 'x'))
+
+    Uf = w.fill_sea_over_land(U, w.masku).values.ravel()[np.asarray(w.sea_index_U)]
+    Vf = w.fill_sea_over_land(V, w.maskv).values.ravel()[np.asarray(w.sea_index_V)]
+    uT = zint.remap(zint.linear_weights(w.tri_sea_U, w.latlon), Uf)
+    vT = zint.remap(zint.linear_weights(w.tri_sea_V, w.latlon), Vf)
+    fac = np.deg2rad(np.asarray(w.tangle).ravel()[np.asarray(w.sea_index)])
+    u = w._to_target(zint.remap(w.weights, uT * np.cos(fac) - vT * np.sin(fac))[:, None], (), False)
+    v = w._to_target(zint.remap(w.weights, uT * np.sin(fac) + vT * np.cos(fac))[:, None], (), False)
+
+    ui, vi = w.interp_UV(U.fillna(1.e20), V.fillna(1.e20))
+    np.testing.assert_allclose(ui.values, u, rtol=1e-10, atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(vi.values, v, rtol=1e-10, atol=1e-12, equal_nan=True)
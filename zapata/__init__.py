@@ -9,6 +9,8 @@ The library core is composed by the following **submodules**:
 
 - **mapping**: mapping routines based on Cartopy (https://scitools.org.uk/cartopy) and GEOCAT (https://geocat.ucar.edu/) libraries.
 
+- **significance**: vectorized significance tests for fields.
+
 - **colormap**: routines to use colormap in xml format
 
 - **lib**: utilities for the rest of the modules.
@@ -17,6 +17,7 @@ from typing import (
 )
 import math
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 import scipy.linalg as sc
 import scipy.special as sp
@@ -28,9 +29,11 @@ import xarray as xr
 import pandas as pd
 
 import scipy.ndimage as ndimage
+from scipy.fftpack import next_fast_len
 
 import zapata.lib as lib
 import zapata.data as zdat
+import zapata.significance as zsig
 import klus.kernels as ker
 
 from geocat.viz import cmaps as gvcmaps
@@ -39,11 +42,16 @@ from geocat.viz import util as gvutil
 import tqdm as tm
 import mpl_toolkits.axes_grid1 as tl
 
-def zonal_var(dataset, var, season=None, level=None, period=None, option='LonTime',verbose=False):
+def zonal_var(dataset, var, season=None, level=None, period=None, option='LonTime', block=1, verbose=False):
     """
     A routine to average xarray 
     
     This routine will accept xarray up to four dimensions (lat,lon,pressure, time) and return the averaged arrays with compatible dimensions.
+
+    The data are read in blocks of `block` years and each block is reduced as soon as it is read, 
+    the zonal mean is taken for each month and the time mean is accumulated as a running weighted sum.
+    The full field is never kept in memory, for the options `LonTime` and `Time` the memory
+    is proportional to the size of the output.
     
     Parameters
     ----------
@@ -63,6 +71,8 @@ def zonal_var(dataset, var, season=None, level=None, period=None, option='LonTim
             - 'LonTime'    Longitude and Time   
             - 'Lon'        Longitude    
             - 'Time'       Time averaging   
+    block :
+        Number of years read at once
     verbose:    
         Tons of Output
     
@@ -79,26 +89,106 @@ def zonal_var(dataset, var, season=None, level=None, period=None, option='LonTim
     >>> zonal_var('GPCP','TPREP','DJF',option='Time',verbose=True)   # Time average 
     """
 
-    xx=zdat.read_data(dataset=dataset, var=var, level=level, season=season, period=period, verbose=verbose)
-
-    if option == 'LonTime':
-        zon = xx.mean(dim='lon').mean(dim='time')
-    elif option == 'Time':
-        zon = xx.mean(dim='time')
-    elif option == 'Lon':
-        zon = xx.mean(dim='lon')
+    if option not in ['LonTime','Time','Lon']:
+        return zdat.read_data(dataset=dataset, var=var, level=level, season=season, period=period, verbose=verbose)
+
+    if period is None:
+        period = zdat.inquire_catalogue(dataset)['year_bounds']
+    weights = _season_weights(period, season) if season is not None else None
+
+    zon = None
+    wsum = None
+    parts = []
+    for year in range(period[0], period[1] + 1, block):
+        years = [year, min(year + block - 1, period[1])]
+        if verbose:
+            print(f' Reducing years {years[0]}-{years[1]}')
+        xx = zdat.read_data(dataset=dataset, var=var, level=level, season=season, period=years, average=False, verbose=verbose)
+        if option in ['LonTime','Lon']:
+            xx = xx.mean(dim='lon')
+        if option == 'Lon':
+            parts.append(xx.load())
+            continue
+
+        # Running weighted sum over time, missing values do not contribute
+        if weights is None:
+            w = xr.ones_like(xx.time, dtype=float)
+        else:
+            w = _lookup_weights(weights, xx.time)['weight']
+        part = (xx * w).sum(dim='time').load()
+        wpart = (xx.notnull() * w).sum(dim='time').load()
+        zon = part if zon is None else zon + part
+        wsum = wpart if wsum is None else wsum + wpart
+
+    if option == 'Lon':
+        zon = xr.concat(parts, dim='time')
+        if season is not None and len(zdat.define_time_frames(season)[season]) > 1:
+            # Weighted mean of the months of each season
+            w = _lookup_weights(weights, zon.time)
+            zon = (zon * w['weight']).groupby(w['season']).sum(dim='time') / \
+                (zon.notnull() * w['weight']).groupby(w['season']).sum(dim='time')
+            zon = zon.rename({'season': 'time'})
+            zon.attrs.update({'time_resample':season})
+    else:
+        zon = zon / wsum.where(wsum > 0)
 
     return zon
 
-def smooth_xarray(X,sigma=5,order=0,mode='wrap'):
+def _season_weights(period, season):
+    '''
+    Weights of each month for the time mean of `season` over `period`.
+
+    For multi-month seasons each month is weighted by its length relative to
+    the season it belongs to, as in :func:`zapata.data.da_time_mean`.
+    Single months have unit weights.
+
+    Returns a DataFrame indexed by month, with the weight and the 
+    end date of the season each month belongs to.
+    '''
+    time_frames = zdat.define_time_frames(season)
+    months = pd.date_range(f'{period[0]}-01-01', f'{period[1]}-12-01', freq='MS')
+    if len(time_frames[season]) > 1:
+        seasons = pd.PeriodIndex(months, freq=time_frames[season][0])
+        sel = months.month.isin(list(time_frames[season][2]))
+        months, seasons = months[sel], seasons[sel]
+        days = pd.Series(months.days_in_month.values, index=seasons)
+        weights = (days / days.groupby(level=0).transform('sum')).values
+    else:
+        months = months[months.month == time_frames[season][0]]
+        seasons = pd.PeriodIndex(months, freq='M')
+        weights = np.ones(len(months))
+    return pd.DataFrame({'weight': weights, 'season': seasons.end_time.normalize()}, 
+            index=pd.PeriodIndex(months, freq='M'))
+
+def _lookup_weights(weights, time):
+    '''Weights and season of the months in `time`.'''
+    w = weights.loc[pd.PeriodIndex(time.data, freq='M')]
+    return {c: xr.DataArray(w[c].values, dims='time', coords={'time': time}, name=c) for c in w.columns}
+
+def smooth_xarray(X,sigma=5,order=0,mode='wrap',dims=('lat','lon'),nan='normalize',method='auto',workers=None):
     """
     Smooth xarray X with a gaussian filter . 
 
     It uses a routine from scipy ndimage ( ``ndimage.gaussian_filter``). 
-    The filter is applied to all dimensions.
+    The filter is applied to the dimensions `dims`, all the other dimensions 
+    of `X` (e.g. time, level) are treated as a batch of independent fields. 
+    The fields are smoothed in parallel in a thread pool, the filter
+    is executed in C and it releases the GIL.
     See the doc page of ( ``ndimage.gaussian_filter``) for a full documentation.
     The filter can be used for periodic fields, then the correct setting of `mode` is 'wrap'
 
+    Fields with missing values (e.g. ocean fields with land points) are smoothed
+    by normalized convolution: the data with NaN set to zero and the mask of valid points are filtered
+    separately and then divided, so that only valid points contribute to the smoothed value.
+    The missing points stay NaN in the output.
+
+    For large `sigma` the cost of the direct filter grows with the width of the kernel, 
+    in this case the filter can be applied in spectral space with FFT, multiplying by the 
+    transfer function of the Gaussian. The FFT is periodic along the dimensions with mode 'wrap'
+    (e.g. longitude), the other dimensions are padded according to `mode` before the transform.
+    The cost of the spectral filter does not depend on `sigma`. With `method` 'auto' the path is chosen 
+    according to the kernel width and the size of the grid.
+
     Parameters
     -----------
     X :  
@@ -129,36 +219,144 @@ def smooth_xarray(X,sigma=5,order=0,mode='wrap'):
 
         *   ‘wrap’ (a b c d | a b c d | a b c d)
             The input is extended by wrapping around to the opposite edge.
+    dims:
+        Dimensions to be smoothed, default ('lat','lon')
+    nan:
+        Treatment of missing values    
+            =============     ==========================================================
+            normalize         Normalized convolution, NaN do not contribute (default)
+            propagate         Filter as it is, NaN are spread by the filter
+            =============     ==========================================================
+        Normalized convolution is used only for `order` 0.
+    method:
+        Filtering method    
+            =============     ==========================================================
+            auto              Choose according to `sigma` and grid size (default)
+            direct            Direct convolution with ``ndimage.gaussian_filter``
+            fft               Spectral filter with FFT, only for `order` 0
+            =============     ==========================================================
+    workers:
+        Number of threads, default is the `ThreadPoolExecutor` default
 
     Returns
     --------
     smooth_array:   
-        numpy array
+        xarray with the same dimensions and coordinates of `X`
 
     Examples
     --------
     Smooth a X[lat,lon] array with nearest repetition in *lat* and periodicity in *lon*
     
-    >>> smooth_array(X,sigma=5,order=0,mode=['nearest','wrap']) 
+    >>> smooth_xarray(X,sigma=5,order=0,mode=['nearest','wrap']) 
+
+    Smooth all months and levels of an ocean field X[time,lev,lat,lon] with land points
+    
+    >>> smooth_xarray(X,sigma=3,mode=['nearest','wrap'],nan='normalize') 
+
+    Broad-scale smoothing of a global 0.25 field, in spectral space
+
+    >>> smooth_xarray(X,sigma=40,mode=['nearest','wrap'],method='fft') 
     
     """
-    lat = X.lat
-    lon = X.lon
-    if (X.isnull()).any():
-        #there are NaN
-        # TO DO
-        temp = ndimage.gaussian_filter(X, sigma=sigma, order=order,mode=mode)
-    else:
-        temp = ndimage.gaussian_filter(X, sigma=sigma, order=order,mode=mode)
+    core = list(dims)
+    batch_dims = [d for d in X.dims if d not in core]
+    Xt = X.transpose(*batch_dims, *core)
+    data = np.asarray(Xt.data, dtype=float)
+    fields = data.reshape((-1,) + data.shape[-len(core):])
+    missing = np.isnan(fields)
+    normalize = nan == 'normalize' and order == 0 and missing.any()
+    if method == 'auto':
+        method = 'fft' if order == 0 and _use_fft(fields.shape[1:], sigma) else 'direct'
+    elif method == 'fft' and order != 0:
+        raise ValueError(f'Spectral smoothing only for order 0, order {order}')
+    temp = np.empty_like(fields)
+
+    def _smooth(i):
+        if normalize:
+            temp[i] = _normalized_filter(fields[i], missing[i], sigma, mode, method)
+        elif method == 'fft':
+            temp[i] = _gaussian_fft(fields[i], sigma, mode)
+        else:
+            temp[i] = ndimage.gaussian_filter(fields[i], sigma=sigma, order=order, mode=mode)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_smooth, range(fields.shape[0])))
     
-    zarray = xr.DataArray(temp,dims=('lat','lon'),coords={'lat':lat,'lon':lon})
+    zarray = xr.DataArray(temp.reshape(data.shape),dims=Xt.dims,coords=Xt.coords).transpose(*X.dims)
     return zarray
 
-def anomaly(var,option='anom',freq='month'):
+def _normalized_filter(x, missing, sigma, mode, method='direct'):
+    '''
+    Gaussian filter of `x` by normalized convolution, 
+    points in `missing` are excluded and returned as NaN
+    '''
+    valid = (~missing).astype(float)
+    if method == 'fft':
+        num = _gaussian_fft(np.where(missing, 0., x), sigma, mode)
+        den = _gaussian_fft(valid, sigma, mode)
+    else:
+        num = ndimage.gaussian_filter(np.where(missing, 0., x), sigma=sigma, mode=mode)
+        den = ndimage.gaussian_filter(valid, sigma=sigma, mode=mode)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = num/den
+    out[missing] = np.nan
+    return out
+
+# Map of `ndimage` boundary modes to `np.pad` modes
+_PAD_MODES = {'reflect': 'symmetric', 'mirror': 'reflect', 'nearest': 'edge', 'constant': 'constant', 'wrap': 'wrap'}
+
+def _use_fft(shape, sigma, truncate=4.0):
+    '''
+    Choose the spectral filter when the taps of the separable direct filter
+    exceed the cost of the FFT, estimated empirically as `6 log2(N)` per point
+    '''
+    sigma = np.broadcast_to(sigma, (len(shape),))
+    taps = np.sum(2*np.ceil(truncate*sigma) + 1)
+    return taps > 6*np.log2(np.prod(shape))
+
+def _gaussian_fft(x, sigma, mode, truncate=4.0):
+    '''
+    Gaussian filter of `x` in spectral space.
+
+    Axes with mode 'wrap' are treated as periodic, the others are padded
+    by `truncate*sigma` points according to `mode`, extended to a fast FFT length.
+    '''
+    ndim = x.ndim
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (ndim,))
+    modes = [mode]*ndim if isinstance(mode, str) else list(mode)
+    pad = []
+    for n, s, m in zip(x.shape, sigma, modes):
+        if m == 'wrap':
+            pad.append((0, 0))
+        else:
+            nf = next_fast_len(n + 2*int(truncate*s + 0.5))
+            pad.append(((nf - n)//2, nf - n - (nf - n)//2))
+    xp = x
+    for ax, m in enumerate(modes):
+        if pad[ax] != (0, 0):
+            width = [(0, 0)]*ndim
+            width[ax] = pad[ax]
+            xp = np.pad(xp, width, mode=_PAD_MODES[m])
+
+    # Transfer function of the Gaussian
+    freqs = [np.fft.fftfreq(n) for n in xp.shape[:-1]] + [np.fft.rfftfreq(xp.shape[-1])]
+    g = 1.
+    for ax, (f, s) in enumerate(zip(freqs, sigma)):
+        shape = [1]*ndim
+        shape[ax] = f.size
+        g = g*np.exp(-2*(np.pi*s*f)**2).reshape(shape)
+    out = np.fft.irfftn(np.fft.rfftn(xp)*g, s=xp.shape)
+
+    return out[tuple(slice(p[0], p[0] + n) for p, n in zip(pad, x.shape))]
+
+def anomaly(var,option='anom',freq='month',clim=None):
     """
     Compute Anomalies according to *option*
 
-    Long description here.
+    If a climatology `clim` is given (e.g. retrieved from :class:`Clim_Store`)
+    the anomalies are computed with respect to it and the climatology is not
+    recomputed from `var`. The subtraction is lazy when `var` and `clim` are
+    backed by `dask`.
 
     Parameters
     ----------
@@ -174,15 +372,30 @@ def anomaly(var,option='anom',freq='month'):
             =============     ==========================================================
     freq :  
         Frequency of data   
+    clim :  xarray Dataset
+        Precomputed climatology with variables `mean` and `std`, 
+        used by options `anom` and `anomstd`
 
     Returns
     -------
     anom :  xarray
 
+    Examples
+    --------
+    Anomalies with respect to a stored 1981-2010 climatology
+
+    >>> clim = Clim_Store().get('ERA5_MM','T',level=[500],period=[1981,2010])
+    >>> anom = anomaly(var,option='anom',clim=clim)
+
     """
 
     frequency = 'time.' + freq
-    if option == 'deviation':
+    if clim is not None and option in ['anom','anomstd']:
+        if option == 'anom':
+            anom = var.groupby(frequency) - clim['mean']
+        else:
+            anom = (var.groupby(frequency) - clim['mean']).groupby(frequency) / clim['std']
+    elif option == 'deviation':
         anom = var - var.mean(dim='time')
     elif option == 'deviation_std':
         anom = (var - var.mean(dim='time'))/var.std(dim='time')
@@ -201,6 +414,177 @@ def anomaly(var,option='anom',freq='month'):
         raise SystemExit
 
     return anom
+
+def climatology(var,freq='month',percentiles=None):
+    """
+    Compute climatological statistics of `var` grouped by `freq`
+
+    Parameters
+    ----------
+    var :   xarray
+        array to compute the climatology
+    freq :  
+        Frequency of data, the grouping is done on `time.freq`
+    percentiles : list
+        Percentiles (0-100) to be computed, optional
+
+    Returns
+    -------
+    clim :  xarray Dataset
+        Dataset with variables  
+            =============     ==========================================================
+            mean              Mean for each `freq` group
+            std               Standard deviation for each `freq` group
+            count             Number of valid samples for each `freq` group
+            perc              Percentiles for each `freq` group (if requested)
+            =============     ==========================================================
+
+    """
+    frequency = 'time.' + freq
+    grp = var.groupby(frequency)
+    clim = xr.Dataset({'mean': grp.mean('time'), 'std': grp.std('time'), 'count': grp.count('time')})
+    if percentiles is not None:
+        if var.chunks is not None:
+            # quantiles need the whole time series in one chunk
+            grp = var.chunk({'time': -1}).groupby(frequency)
+        perc = grp.quantile(np.asarray(percentiles)/100., dim='time')
+        clim['perc'] = perc.rename({'quantile':'percentile'}).assign_coords(percentile=list(percentiles))
+    return clim
+
+class Clim_Store():
+    """ This class manages climatologies stored on disk.
+
+    Climatologies are computed once with :func:`climatology` over a 
+    baseline period and saved in netCDF format in the directory `root`.
+    They are keyed by dataset, variable, level, baseline period and frequency,
+    later requests for the same climatology are read from disk without
+    accessing the baseline data again.
+
+    Stored climatologies are opened lazily and can be passed to :func:`anomaly`.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the store. If not given it is taken from the 
+        environment variable `ZAPATA_CLIM`, or it defaults to `~/.zapata/climatology`
+
+    Attributes
+    ----------
+    root : str
+        Directory of the store
+
+    Examples    
+    --------    
+    Compute (or retrieve) the 1981-2010 monthly climatology of T at 500 hPa
+
+    >>> store = Clim_Store()
+    >>> clim = store.get('ERA5_MM','T',level=[500],period=[1981,2010])
+
+    Anomalies of the latest year, the baseline period is not read again
+
+    >>> var = zdat.read_data('ERA5_MM','T',level=[500],period=[2020,2020])
+    >>> anom = anomaly(var,clim=clim)
+
+    """
+
+    __slots__ = ('root',)
+
+    def __init__(self, root=None):
+        self.root = lib.store_root(root, 'ZAPATA_CLIM', '.zapata/climatology')
+
+    def __repr__(self):
+        '''  Printing Information '''
+        print(f' Climatology store at {self.root}')
+        for key in self.list():
+            print(f'   {key}')
+        return '\n'
+
+    def key(self, dataset, var, level=None, period=None, freq='month'):
+        '''
+        Key identifying a climatology in the store.
+
+        If `period` is None the whole time window of the dataset is used.
+        '''
+        if period is None:
+            period = zdat.inquire_catalogue(dataset)['year_bounds']
+        lev = 'all' if level is None else '-'.join([str(l) for l in level])
+        key = '_'.join([dataset, var, lev, f'{period[0]}-{period[1]}', freq])
+        return key.replace(' ','').replace('/','-')
+
+    def path(self, dataset, var, level=None, period=None, freq='month'):
+        '''File of the climatology in the store.'''
+        return self.root + '/' + self.key(dataset, var, level, period, freq) + '.nc'
+
+    def list(self):
+        '''List the keys of the stored climatologies.'''
+        return sorted([f[:-3] for f in os.listdir(self.root) if f.endswith('.nc')])
+
+    def get(self, dataset, var, level=None, period=None, freq='month', percentiles=None, recompute=False, verbose=False):
+        '''
+        Retrieve a climatology from the store, computing it if necessary.
+
+        Parameters
+        ----------
+        dataset :
+            Name of the dataset
+        var :
+            Variable
+        level : list
+            Vertical levels, as in :func:`zapata.data.read_data`
+        period : list
+            Two element list with initial and final years of the baseline
+        freq :
+            Frequency of the climatology, default `month`
+        percentiles : list
+            Percentiles (0-100) to be stored with the climatology
+        recompute : bool
+            Recompute the climatology even if it is in the store
+        verbose : bool
+            Tons of output
+
+        A climatology that is recomputed replaces the file in the store, the datasets 
+        already returned by `get` keep reading the previous file.
+
+        Returns
+        -------
+        clim : xarray Dataset
+            Climatology opened lazily from the store
+        '''
+        file = self.path(dataset, var, level, period, freq)
+        if os.path.isfile(file) and not recompute:
+            clim = xr.open_dataset(file, chunks={})
+            if percentiles is None or ('perc' in clim and \
+                    set(percentiles) <= set(clim.percentile.data.tolist())):
+                if verbose:
+                    print(f' Climatology read from {file}')
+                return clim
+            clim.close()
+
+        if verbose:
+            print(f' Computing climatology {self.key(dataset, var, level, period, freq)}')
+        xx = zdat.read_data(dataset=dataset, var=var, level=level, period=period, verbose=verbose)
+        clim = climatology(xx, freq=freq, percentiles=percentiles)
+        clim.attrs.update({'dataset': dataset, 'var': var, 'freq': freq,
+                'level': str(level), 'period': str(period)})
+        # Written aside and moved in place, datasets already open on `file` keep the old file
+        tmp = file + f'.tmp{os.getpid()}'
+        try:
+            clim.to_netcdf(tmp)
+        except BaseException:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+            raise
+        os.replace(tmp, file)
+        if verbose:
+            print(f' Climatology written to {file}')
+        return xr.open_dataset(file, chunks={})
+
+    def remove(self, dataset, var, level=None, period=None, freq='month'):
+        '''Remove a climatology from the store.'''
+        file = self.path(dataset, var, level, period, freq)
+        if os.path.isfile(file):
+            os.remove(file)
+
 class Xmat():
     """ This class creates xarrays in vector mathematical form.
 
@@ -223,6 +607,8 @@ class Xmat():
         Length of time points
     _npoints :
         Length of spatial points
+    _Astd :
+        Standardized data matrix, cached for Monte Carlo tests
     
     Examples    
     --------    
@@ -232,7 +618,7 @@ class Xmat():
 
     """
 
-    __slots__ = ('A','_ntime','_npoints')
+    __slots__ = ('A','_ntime','_npoints','_Astd')
 
     def __init__(
         self,
@@ -246,6 +632,7 @@ class Xmat():
         self.A = X.stack(z=dims).transpose()
         self._ntime = len(X.time.data)
         self._npoints = len(X.stack(z=dims).z.data)
+        self._Astd = None
         print(' Created mathematical matrix A, \n \
                 stacked along dimensions {} '.format(dims))
         
@@ -420,14 +807,74 @@ class Xmat():
         """
 
         self.A = anomaly(self.A,**kw)
+        self._Astd = None
         return 
-def feature_to_input(k,num,PsiX,Proj,icstart=0.15):
+
+    def corr_mc(self, y, nsurr=1000, method='phase', block=None, batch=100, workers=None, client=None, seed=None):
+        """
+        Compute correlation of data matrix `A` with index `y` and its Monte Carlo significance.
+
+        The p-value returned by `corr` assumes independent samples. Here the p-value is
+        obtained by correlating `A` with `nsurr` surrogates of the index that preserve its 
+        autocorrelation, either by phase randomization or block bootstrap. 
+        Each batch of surrogates is a single matrix product with the standardized `A`, 
+        that is computed once and cached. The batches can be computed on a process pool or on a 
+        `dask` cluster. See :func:`zapata.significance.mc_corr_pvalue`.
+
+        Parameters
+        ----------
+        y : xarray  
+            Index, should have the same dimension length `time` 
+        nsurr : int
+            Number of surrogates
+        method : str
+            * 'phase' _Phase randomization
+            * 'block' _Block bootstrap
+        block : int
+            Block length for the block bootstrap
+        batch : int
+            Number of surrogates in each matrix product
+        workers : int
+            Number of processes, if None the computation is serial
+        client :
+            `dask` client, e.g. from `zeus.start_dask`
+        seed : int
+            Seed for the random numbers
+
+        Returns
+        -------
+        corr :  Correlation array   
+        prob :  p-value array  
+
+        Examples
+        --------
+        Correlation of data matrix `Z` with `index`, with 1000 block bootstrap surrogates
+
+        >>> corr,p = Z.corr_mc(index,nsurr=1000,method='block',block=12,workers=8)
+        """
+        if self._Astd is None:
+            self._Astd = zsig.standardize(np.asarray(self.A.data, dtype=float), axis=1)
+        _r, _p = zsig.mc_corr_pvalue(self._Astd, np.asarray(y.data), nsurr=nsurr, method=method, \
+                block=block, batch=batch, workers=workers, client=client, seed=seed, standardized=True)
+
+        corr = self.A.isel(time=0).copy()
+        corr.data = _r
+        prob = self.A.isel(time=0).copy()
+        prob.data = _p
+        return corr , prob
+def feature_to_input(k,num,PsiX,Proj,icstart=0.15,tol=1.e-5,maxiter=1000):
     ''' Transform from Feature space to input space.
 
     It computes an approximate back-image for the Gaussian kernels and
     and exact backimage for kernels based on scalar product whose nonlinear
     map can be inverted.
 
+    For the Gaussian kernel the fixed-point iteration of Scholkopf (1999) is
+    carried out for all the `num` vectors together. Each iteration requires
+    a single evaluation of the kernel matrix between the current iterates
+    and the data with ``gramian2``, convergence is checked separately for each
+    vector and the converged ones are not updated anymore.
+
     Still working on.
 
     Parameters  
@@ -443,14 +890,15 @@ def feature_to_input(k,num,PsiX,Proj,icstart=0.15):
             Projction coefficients on Feature Space
         icstart :   
             Starting Value for iteration    
+        tol :
+            Tolerance for the convergence of the iteration
+        maxiter :
+            Maximum number of iterations
     Returns
     ------- 
         back_image : array(npoints, num)    
     '''
     nx,nt=PsiX.shape
-    if nx > 10000 :
-        print(' Vector is too large for back-image')
-        return
     
     name = k.name
     if name == 'Gaussian':
@@ -459,49 +907,37 @@ def feature_to_input(k,num,PsiX,Proj,icstart=0.15):
         
         #Expand the eigenfunction in the data space
         # Use iteration by Scholkopf 1999
-        xold = np.zeros(PsiX[:,0].shape)
-        DataEig=np.zeros([nx,num],dtype=complex)
-        for it in range(num):    
-            xold[:]=icstart
-            vec=Proj[:,it]
-            conv=1
-            kount=0
-            while conv > 1.e-5:
-                nom=0.0
-                den=0.0        
-                for j in range(nt):
-                    pr=vec[j]*k(xold,PsiX[:,j])
-                    nom=pr*PsiX[:,j] + nom
-                    den=pr + den
-                xnew=nom/den
-                conv = sc.norm(xnew - xold,ord=2)
-                #print( '  Convergence/j  ', conv,it)
-                xold=xnew  
-                kount = kount + 1
-                if kount > 1000:
-                    print( '  Not Converged -- Convergence/j  ', conv,it,kount,den)
-                    break
-            DataEig[:,it]= xnew
-            print( '  Convergence/num  ', conv,it)
+        coef = Proj[:,0:num]
+        DataEig=np.full([nx,num],icstart,dtype=complex)
+        active = np.arange(num)
+        conv = np.zeros(num)
+        kount=0
+        while active.size > 0:
+            xold = DataEig[:,active]
+            # k(x,y) for complex x and real y: |x - y|^2 = |Re x - y|^2 + |Im x|^2
+            kmat = ker.gramian2(xold.real,PsiX,k) * \
+                np.exp(-np.sum(np.abs(xold.imag)**2,axis=0)/(2*k.sigma**2))[:,None]
+            pr = kmat * coef[:,active].T
+            xnew = (PsiX @ pr.T)/pr.sum(axis=1)
+            conv[active] = sc.norm(xnew - xold,axis=0)
+            DataEig[:,active] = xnew
+            kount = kount + 1
+            active = active[conv[active] > tol]
+            if kount >= maxiter:
+                for it in active:
+                    print( '  Not Converged -- Convergence/j  ', conv[it],it,kount)
+                break
+        for it in range(num):
+            print( '  Convergence/num  ', conv[it],it)
     elif name == 'Polynomial':   
         #Exact method
         print(' Kernel  ',name)
         print('Reconstructing Projection as (nx,nt) ', '(',nx,',',nt,')')
-        I = np.eye(nx)
-        xold = np.zeros(PsiX[:,0].shape)
-        DataEig=np.zeros([nx,num],dtype=complex)
-        G00 = ker.gramian2(PsiX,I,k)
-        for it in range(num):
-            print(' Vector Number  ---> ',it)
-            acc = G00 @ Proj
-            print(acc.shape,G00.shape,Proj.shape)
-            
-            #for i in range(nx):
-            #    sum=0.0
-             #   for j in range(nt):
-             #       sum = Proj[j,it]* k(PsiX[:,j],I[:,i])+sum
-            DataEig[:,it] = (acc-k.c)**(1/k.p)
+        # Kernel with the canonical basis, it is gramian2(PsiX,I,k).T
+        # without forming the identity matrix
+        G00 = (k.c + PsiX)**k.p
+        acc = G00 @ Proj[:,0:num]
+        DataEig = ((acc-k.c)**(1/k.p)).astype(complex)
     else:
         print('Error in Reconstruction')
-    return DataEig   
-      
+    return DataEig
@@ -47,6 +47,9 @@ A new dataset can be included by editing the catalogue YAML files (either main o
             mask: dict                         # Two element dictionary to identify input mask file, with
                                                #   'file': full path of filename 
                                                #   'coord_map': mapping of dimensions names, as described above       
+       grids: dict                             # (optional) grids of the ocean interpolators, keyed by grid name, described as in `interp.GRIDS`
+                                               # with the 'mask', 'coords' and 'angle' files. They are added to `interp.grid_registry`
+                                               # by `grid_registry.from_catalogue(<DATASET_NAME>)`
 
 ===================================
 '''
@@ -156,7 +159,7 @@ def inquire_catalogue(dataset=None, info=False):
     return out
 
 
-def read_data(dataset=None, var=None, period=None, level=None, season=None, region=None, verbose=False):
+def read_data(dataset=None, var=None, period=None, level=None, season=None, region=None, average=True, verbose=False):
     '''
     Load into a DataArray the requested variable from dataset source.
 
@@ -174,6 +177,9 @@ def read_data(dataset=None, var=None, period=None, level=None, season=None, regi
         Month ('JAN'), season ('DJF', 'AMJ') or annual ('ANN')
     region : list
         Region corners [LonMax, LonMin, LatMax, LatMin]
+    average : Boolean
+        True/False -- Average over the time windows of `season`, 
+        otherwise return the monthly means of the months in `season`
     verbose : Boolean
         True/False -- Tons of Output
 
@@ -194,7 +200,10 @@ def read_data(dataset=None, var=None, period=None, level=None, season=None, regi
  
     # temporal sampling
     if season is not None:
-        out = da_time_mean(out, season)
+        if average:
+            out = da_time_mean(out, season)
+        else:
+            out = da_time_select(out, season)
 
     # horizontal sampling
     #TODO  need test with NEMO grid as coordinate are not associated to dimensions (maybe a dedicated function)
@@ -324,6 +333,42 @@ def da_time_mean(da, sample):
     return da
 
 
+def da_time_select(da, sample):
+    '''
+    Sample datarray based on month/season without averaging over timewindows
+
+    Parameters
+    ----------
+    da : DataArray
+        Input data
+    sample : string
+        Identifier of temporal sampling (e.g., JAN, FEB, ...,  ANN, DJF, MAM ...)
+
+    Returns
+    -------
+    out : DataArray
+        Monthly means of the months belonging to `sample`
+
+    Examples
+    --------
+
+    >>> da = da_time_select(da, 'DJF')
+    '''
+    time_frames = define_time_frames(sample)
+
+    # reduce data to months
+    da = da.resample(time='M').mean(dim='time')
+
+    if len(time_frames[sample]) > 1:
+        months = list(time_frames[sample][2])
+    else:
+        months = time_frames[sample]
+    da = da.sel(time=da.time.dt.month.isin(months))
+    da.attrs.update({'time_select':sample})
+
+    return da
+
+
 def define_time_frames(sample):
     '''
     Define time frames handled by the library
@@ -37,6 +37,17 @@ def showfig(pic):
         print('Displaying '+ pic)
     print('Stop')
     
+def store_root(root, env, default):
+    """ Directory of an on-disk store (climatologies, interpolators), created if needed.
+
+    If `root` is None it is taken from the environment variable `env`,
+    or it is `default` under the user's home directory.
+    """
+    if root is None:
+        root = os.environ.get(env, os.path.expanduser("~") + '/' + default)
+    os.makedirs(root, exist_ok=True)
+    return root
+
 def remove_values_from_list(the_list, val):
     """ Remove value `val` from list `the_list`"""
     return [value for value in the_list if value != val]
@@ -0,0 +1,410 @@
+'''
+**Statistical significance module**
+
+Significance tests for fields stored as `xarray` DataArray.
+
+The tests are written with `xarray` operations and the Student's t distribution
+is evaluated with the vectorized CDF ``scipy.special.stdtr`` through ``xr.apply_ufunc``,
+therefore `dask` backed arrays are processed lazily and chunk by chunk.
+Significance masks for large 3D fields are computed in parallel only when requested.
+
+- :meth:`ttest_1samp<zapata.significance.ttest_1samp>` : One-sample t-test
+- :meth:`ttest_ind<zapata.significance.ttest_ind>` : Two-sample t-test for independent samples
+- :meth:`effective_sample_size<zapata.significance.effective_sample_size>` : Effective sample size for autocorrelated series
+- :meth:`significance_mask<zapata.significance.significance_mask>` : Mask of significant points
+- :meth:`surrogates<zapata.significance.surrogates>` : Surrogates of an index by block bootstrap or phase randomization
+- :meth:`mc_corr_pvalue<zapata.significance.mc_corr_pvalue>` : Monte Carlo p-value of correlations with an index
+- :meth:`standardize<zapata.significance.standardize>` : Standardized data along the time
+
+The degrees of freedom can be corrected for the autocorrelation of the samples using the
+effective sample size of a red noise process,
+
+.. math::
+
+    n_{eff} = n \\frac{1 - r_1}{1 + r_1}
+
+where :math:`r_1` is the lag-1 autocorrelation.
+
+For correlations with autocorrelated indices the p-values can be obtained by Monte Carlo,
+correlating the field with surrogates of the index that preserve its autocorrelation. The surrogates are
+processed in batches, each batch is a single matrix product with the standardized data matrix, and the
+batches can be distributed over a process pool or a `dask` cluster.
+
+===================================
+'''
+
+import numpy as np
+import xarray as xr
+import scipy.special as sp
+from concurrent.futures import ProcessPoolExecutor
+
+
+def effective_sample_size(a, dim='time'):
+    '''
+    Effective sample size for autocorrelated samples.
+
+    It is estimated from the lag-1 autocorrelation of `a` along `dim`,
+    negative autocorrelations are not used to increase the sample size.
+
+    Parameters
+    ----------
+    a : xarray
+        sample observation
+    dim : string
+        dimension along which the samples are taken
+
+    Returns
+    -------
+    neff : xarray
+        effective sample size
+
+    Examples
+    --------
+
+    >>> neff = effective_sample_size(sst, dim='time')
+    '''
+    n = a.count(dim)
+    a0 = a - a.mean(dim)
+    r1 = (a0 * a0.shift({dim: 1})).sum(dim) / (a0 * a0).sum(dim)
+    r1 = r1.clip(0., 1.)
+    neff = n * (1. - r1) / (1. + r1)
+
+    return neff.clip(2., None)
+
+
+def ttest_1samp(a, popmean=0., dim='time', neff=None):
+    """
+    This is a two-sided test for the null hypothesis that the expected value
+    (mean) of a sample of independent observations `a` is equal to the given
+    population mean, `popmean`
+
+    Inspired here: https://github.com/scipy/scipy/blob/v0.19.0/scipy/stats/stats.py#L3769-L3846
+
+    Parameters
+    ----------
+    a : xarray
+        sample observation
+    popmean : float or array_like
+        expected value in null hypothesis, if array_like than it must have the
+        same shape as `a` excluding the axis dimension
+    dim : string
+        dimension along which to compute test
+    neff : None, 'ar1', float or xarray
+        Effective sample size. If None the number of samples is used,
+        if 'ar1' it is estimated with :func:`effective_sample_size`
+
+    Returns
+    -------
+    mean : xarray
+        averaged sample along which dimension t-test was computed
+    pvalue : xarray
+        two-tailed p-value
+
+    Examples
+    --------
+
+    >>> mean, p = ttest_1samp(composite, 0., dim='time', neff='ar1')
+    """
+    n = a.count(dim)
+    a_mean = a.mean(dim)
+    d = a_mean - popmean
+    v = a.var(dim, ddof=1)
+    nn = _sample_size(a, dim, n, neff)
+
+    t = d / np.sqrt(v / nn)
+    prob = t_pvalue(t, nn - 1)
+
+    return a_mean, prob
+
+
+def ttest_ind(a, b, dim='time', equal_var=True, neff=None):
+    """
+    This is a two-sided test for the null hypothesis that two independent samples
+    `a` and `b` have identical expected values.
+
+    If `equal_var` is True the standard test with pooled variance is used,
+    otherwise the Welch's test.
+
+    Parameters
+    ----------
+    a, b : xarray
+        sample observations, they must agree on all dimensions but `dim`
+    dim : string
+        dimension along which to compute test
+    equal_var : bool
+        Assume equal variances of the populations
+    neff : None, 'ar1', or tuple
+        Effective sample sizes. If None the number of samples is used,
+        if 'ar1' they are estimated with :func:`effective_sample_size`,
+        otherwise a tuple with the effective sample sizes of `a` and `b`
+
+    Returns
+    -------
+    diff : xarray
+        difference of the means of `a` and `b`
+    pvalue : xarray
+        two-tailed p-value
+
+    Examples
+    --------
+
+    >>> diff, p = ttest_ind(warm, cold, dim='time')
+    """
+    na = a.count(dim)
+    nb = b.count(dim)
+    if neff is None or isinstance(neff, str):
+        na = _sample_size(a, dim, na, neff)
+        nb = _sample_size(b, dim, nb, neff)
+    else:
+        na, nb = neff
+
+    diff = a.mean(dim) - b.mean(dim)
+    va = a.var(dim, ddof=1)
+    vb = b.var(dim, ddof=1)
+    if equal_var:
+        df = na + nb - 2
+        svar = ((na - 1) * va + (nb - 1) * vb) / df
+        denom = np.sqrt(svar * (1. / na + 1. / nb))
+    else:
+        vna = va / na
+        vnb = vb / nb
+        df = (vna + vnb)**2 / (vna**2 / (na - 1) + vnb**2 / (nb - 1))
+        denom = np.sqrt(vna + vnb)
+
+    t = diff / denom
+    prob = t_pvalue(t, df)
+
+    return diff, prob
+
+
+def t_pvalue(t, df):
+    '''
+    Two-tailed p-value of the Student's t distribution.
+
+    The CDF is evaluated with ``scipy.special.stdtr`` element by element,
+    lazily and in parallel over the chunks of `dask` arrays.
+
+    Parameters
+    ----------
+    t : xarray
+        t statistics
+    df : float or xarray
+        degrees of freedom
+
+    Returns
+    -------
+    pvalue : xarray
+        two-tailed p-value
+    '''
+    return xr.apply_ufunc(lambda t, df: 2. * sp.stdtr(df, -np.abs(t)), t, df,
+                          dask='parallelized', output_dtypes=[float])
+
+
+def significance_mask(pvalue, alpha=0.05):
+    '''
+    Mask of the points significant at level `alpha`.
+
+    Parameters
+    ----------
+    pvalue : xarray
+        p-value
+    alpha : float
+        significance level
+
+    Returns
+    -------
+    mask : xarray
+        True where the p-value is smaller than `alpha`
+
+    Examples
+    --------
+
+    >>> mean, p = ttest_1samp(composite, 0., dim='time')
+    >>> mean.where(significance_mask(p, 0.05))
+    '''
+    return pvalue < alpha
+
+
+def surrogates(y, nsurr, method='phase', block=None, seed=None):
+    '''
+    Surrogates of the time series `y` preserving its autocorrelation.
+
+    Parameters
+    ----------
+    y : array
+        time series
+    nsurr : int
+        number of surrogates
+    method : string
+        * 'phase', phase randomization of the Fourier coefficients (Ebisuzaki, 1997)
+        * 'block', moving block bootstrap
+    block : int
+        Block length for the block bootstrap, default :math:`n^{1/3}`
+    seed : int or Generator
+        Seed for the random numbers
+
+    Returns
+    -------
+    surr : array (ntime, nsurr)
+        surrogates of `y`
+
+    Examples
+    --------
+
+    >>> s = surrogates(nino34.data, 1000, method='block', block=12)
+    '''
+    rng = np.random.default_rng(seed)
+    y = np.asarray(y, dtype=float)
+    n = y.size
+    if method == 'phase':
+        f = np.fft.rfft(y)
+        phase = np.exp(2j * np.pi * rng.random((f.size, nsurr)))
+        # keep the mean and the Nyquist frequency real
+        phase[0] = 1.
+        if n % 2 == 0:
+            phase[-1] = np.sign(np.cos(np.angle(phase[-1])))
+        surr = np.fft.irfft(f[:, None] * phase, n=n, axis=0)
+    elif method == 'block':
+        if block is None:
+            block = max(1, int(round(n**(1. / 3.))))
+        nblock = -(-n // block)
+        start = rng.integers(0, n - block + 1, size=(nblock, nsurr))
+        index = (start[:, None, :] + np.arange(block)[None, :, None]).reshape(nblock * block, nsurr)
+        surr = y[index[:n]]
+    else:
+        raise ValueError(f'Wrong method for surrogates --> {method}')
+
+    return surr
+
+
+def mc_corr_pvalue(A, y, nsurr=1000, method='phase', block=None, batch=100, workers=None, client=None, seed=None,
+                   standardized=False):
+    '''
+    Monte Carlo p-value of the correlation of the data matrix `A` with the index `y`.
+
+    The correlation of each row of `A` with `y` is compared with the correlations
+    obtained with `nsurr` surrogates of `y` from :func:`surrogates`. The two-sided
+    p-value is the fraction of surrogates with absolute correlation larger than the actual one.
+
+    The surrogates are processed in batches of `batch` surrogates, each batch is one matrix product 
+    of the standardized `A` with the matrix of the surrogates. The batches are distributed over a 
+    process pool with `workers` processes or over a `dask` cluster if `client` is given. 
+    In both cases `A` is sent only once to each worker.
+
+    Parameters
+    ----------
+    A : array (npoints, ntime)
+        data matrix
+    y : array (ntime)
+        index
+    nsurr : int
+        number of surrogates
+    method : string
+        method for the surrogates, see :func:`surrogates`
+    block : int
+        Block length for the block bootstrap
+    batch : int
+        number of surrogates for each matrix product
+    workers : int
+        number of processes, if None the batches are computed serially
+    client : dask.distributed.Client
+        client for a `dask` cluster, e.g. from `zeus.start_dask`
+    seed : int
+        Seed for the random numbers
+    standardized : bool
+        `A` has already zero mean and unit standard deviation along the time, 
+        e.g. from :func:`standardize`, it is used as it is without copies
+
+    Returns
+    -------
+    corr : array (npoints)
+        correlation
+    pvalue : array (npoints)
+        two-sided p-value
+
+    Examples
+    --------
+
+    >>> r, p = mc_corr_pvalue(A, nino34, nsurr=1000, method='block', block=12, workers=8)
+    '''
+    A = np.asarray(A, dtype=float)
+    if not standardized:
+        A = standardize(A, axis=1)
+    y = np.asarray(y, dtype=float)
+    n = y.size
+    corr = A @ standardize(y, axis=0) / n
+
+    rng = np.random.default_rng(seed)
+    sizes = [min(batch, nsurr - i) for i in range(0, nsurr, batch)]
+    surr = (surrogates(y, m, method=method, block=block, seed=rng) for m in sizes)
+
+    if client is not None:
+        fA = client.scatter(A, broadcast=True)
+        fc = client.scatter(corr, broadcast=True)
+        futures = [client.submit(_mc_batch, fc, S, fA) for S in surr]
+        count = sum(client.gather(futures))
+    elif workers is not None:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_mc_init, initargs=(A,)) as pool:
+            count = sum(pool.map(_mc_batch, [corr] * len(sizes), surr))
+    else:
+        count = sum(_mc_batch(corr, S, A) for S in surr)
+
+    pvalue = (count + 1.) / (nsurr + 1.)
+    pvalue[np.isnan(corr)] = np.nan
+
+    return corr, pvalue
+
+
+# Data matrix of the Monte Carlo worker processes
+_MC_A = None
+
+def _mc_init(A):
+    '''Store the data matrix in the worker process.'''
+    global _MC_A
+    _MC_A = A
+
+def _mc_batch(corr, S, A=None):
+    '''Number of surrogates in `S` with correlation larger than `corr`.'''
+    if A is None:
+        A = _MC_A
+    R = A @ standardize(S, axis=0) / S.shape[0]
+    return np.sum(np.abs(R) >= np.abs(corr)[:, None], axis=1)
+
+def standardize(x, axis):
+    '''
+    Remove the mean and normalize by the standard deviation along `axis`.
+
+    A data matrix standardized along the time can be kept and passed to 
+    :func:`mc_corr_pvalue` with `standardized=True` for repeated tests.
+
+    Parameters
+    ----------
+    x : array
+        data
+    axis : int
+        axis of the time
+
+    Returns
+    -------
+    x : array
+        standardized data
+
+    Examples
+    --------
+
+    >>> As = standardize(A, axis=1)
+    >>> r, p = mc_corr_pvalue(As, nino34, standardized=True)
+    '''
+    x = x - x.mean(axis=axis, keepdims=True)
+    return x / x.std(axis=axis, keepdims=True)
+
+
+def _sample_size(a, dim, n, neff):
+    '''Sample size to be used for the degrees of freedom.'''
+    if neff is None:
+        return n
+    elif isinstance(neff, str):
+        if neff == 'ar1':
+            return effective_sample_size(a, dim)
+        raise ValueError(f'Wrong option for effective sample size --> {neff}')
+    return neff